@@ -0,0 +1,104 @@
+'''
+save parsed programs as precompiled `.asdfc` artifacts and load them again, without importing lark.
+
+An artifact starts with a header line, which contains the format version and the python version,
+followed by the marshalled source code, constants, source positions and the encoded syntax tree.
+Nodes of the tree are encoded as `(rule, children)` and tokens as `(type, value, position)`,
+where the rule, type and value are indices into the constants and the position is an index into the positions.
+
+author: Jonas Loos (2023)
+'''
+
+import sys
+import marshal
+from typing import Any
+from stdlib import is_tree
+
+MAGIC = b'ASDFC'
+# increase when the encoding or the meaning of the syntax tree changes, so that stale artifacts are rejected
+FORMAT_VERSION = 1
+# marshalled data can only be loaded by the same python version
+HEADER = MAGIC + f' {FORMAT_VERSION} {sys.implementation.cache_tag}\n'.encode()
+
+
+
+class ArtifactError(Exception):
+    '''error while loading an artifact'''
+
+
+class Node:
+    '''node of a loaded syntax tree, with the attributes of lark's `Tree` used by the interpreter'''
+    __slots__ = ('data', 'children')
+
+    def __init__(self, data : str, children : list[Any]):
+        self.data = data
+        self.children = children
+
+    def __repr__(self):
+        return f'Node({self.data}, {self.children})'
+
+
+class Leaf(str):
+    '''token of a loaded syntax tree, with the attributes of lark's `Token` used by the interpreter'''
+
+    def __new__(cls, type_ : str, value : str, position : tuple[int, int, int, int]):
+        leaf = super().__new__(cls, value)
+        leaf.type = type_
+        leaf.line, leaf.column, leaf.end_line, leaf.end_column = position
+        return leaf
+
+    def __repr__(self):
+        return f'Leaf({self.type}, {str(self)!r})'
+
+    def __reduce__(self):
+        return Leaf, (self.type, str(self), (self.line, self.column, self.end_line, self.end_column))
+
+
+
+def encode(tree : Any, source : str) -> bytes:
+    '''encode a syntax tree and its source code as artifact'''
+    constants : dict[str, int] = {}
+    positions : dict[tuple[int, int, int, int], int] = {}
+    def encode_item(item : Any) -> Any:
+        if item is None:
+            return None
+        if is_tree(item):
+            return constants.setdefault(str(item.data), len(constants)), tuple(encode_item(child) for child in item.children)
+        position = positions.setdefault((item.line, item.column, item.end_line, item.end_column), len(positions))
+        return constants.setdefault(item.type, len(constants)), constants.setdefault(str(item), len(constants)), position
+    encoded = encode_item(tree)
+    return HEADER + marshal.dumps((source, tuple(constants), tuple(positions), encoded))
+
+
+def decode(data : bytes) -> tuple[Node, str]:
+    '''decode an artifact into the syntax tree and its source code'''
+    header, _, payload = data.partition(b'\n')
+    if not header.startswith(MAGIC):
+        raise ArtifactError('Error loading artifact: not an .asdfc file')
+    if header + b'\n' != HEADER:
+        raise ArtifactError(f'Error loading artifact: it was created for `{header.decode(errors="replace")}`, but `{HEADER.decode().strip()}` is needed, compile it again')
+    def decode_item(item : Any) -> Any:
+        if item is None:
+            return None
+        if len(item) == 2:
+            data, children = item
+            return Node(constants[data], [decode_item(child) for child in children])
+        type_, value, position = item
+        return Leaf(constants[type_], constants[value], positions[position])
+    try:
+        source, constants, positions, encoded = marshal.loads(payload)
+        return decode_item(encoded), source
+    except (EOFError, ValueError, TypeError, IndexError) as err:
+        raise ArtifactError(f'Error loading artifact: invalid content ({err})') from err
+
+
+def save(filename : str, tree : Any, source : str) -> None:
+    '''write a syntax tree and its source code to an artifact file'''
+    with open(filename, 'wb') as file:
+        file.write(encode(tree, source))
+
+
+def load(filename : str) -> tuple[Node, str]:
+    '''read an artifact file and return the syntax tree and its source code'''
+    with open(filename, 'rb') as file:
+        return decode(file.read())
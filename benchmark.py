@@ -0,0 +1,294 @@
+'''
+measure the performance of the interpreter.
+
+usage:
+
+```
+python benchmark.py [BENCHMARK...]
+```
+
+author: Jonas Loos (2023)
+'''
+
+import io
+import os
+import sys
+import time
+import textwrap
+import resource
+import tempfile
+import subprocess
+from typing import Callable, Iterable
+from parsing import parse
+from interpreter import interpret, compile, Interpreter  # pylint: disable=redefined-builtin
+import stdlib
+
+
+
+def run_file(filename : str, input_chunks : Iterable[bytes] = (), script : str = 'main.py') -> float:
+    '''run a source code file (or artifact with `runner.py`), pipe the input chunks into it and return the elapsed time in seconds'''
+    start = time.perf_counter()
+    with subprocess.Popen(['python', script, filename], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE) as process:
+        assert process.stdin
+        for chunk in input_chunks:
+            process.stdin.write(chunk)
+        _, stderr = process.communicate()
+    elapsed = time.perf_counter() - start
+    if process.returncode != 0:
+        raise RuntimeError(f'running {filename} failed:\n{stderr.decode()}')
+    return elapsed
+
+
+def run_program(source : str, input_text : str = '', interpreter : Interpreter | None = None) -> float:
+    '''parse and run the given source code in this process and return the elapsed time in seconds, without parsing'''
+    program = parse(textwrap.dedent(source))
+    with io.StringIO(input_text) as input_stream, io.StringIO() as output_stream:
+        start = time.perf_counter()
+        interpret(program, input_stream, output_stream, interpreter)
+        return time.perf_counter() - start
+
+
+def report(label : str, seconds : float, details : str = ''):
+    '''print a single result line'''
+    print(f'  {label:<48} {seconds:8.3f}s  {details}')
+
+
+def max_child_memory() -> float:
+    '''maximum resident memory of all finished child processes so far, in MB'''
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+
+
+
+def bench_streaming():
+    '''line-oriented processing of large piped inputs with `lines()`'''
+    line = b'2023-01-01 12:00:00 INFO some log message of typical length\n'
+    chunk = line * (2**20 // len(line))
+    for megabytes in (1, 10, 50):
+        # pipe the input piece by piece, to keep the memory of this process (and its forks) small
+        seconds = run_file('examples/linecount.asdf', (chunk for _ in range(megabytes)))
+        report(f'linecount.asdf, {megabytes} MB', seconds, f'{megabytes / seconds:6.2f} MB/s, max memory {max_child_memory():.0f} MB')
+
+
+
+def bench_bigint():
+    '''big integer arithmetic, e.g. `factorial(5000)`'''
+    for n in (1000, 5000, 20000):
+        seconds = run_program(f'''\
+            def main()
+                i = 1
+                result = 1
+                while leq(i, {n})
+                    result = mul(result, i)
+                    i = add(i, 1)
+                length("{{result}}")
+        ''')
+        report(f'factorial({n}) with mul in a loop', seconds)
+    for exponent in (10**5, 10**6):
+        seconds = run_program(f'''\
+            def main()
+                x = pow(3, {exponent})
+                length("{{x}}")
+        ''')
+        report(f'pow(3, {exponent}) and conversion to string', seconds)
+    seconds = run_program('''\
+        def main()
+            i = 0
+            while lt(i, 1000)
+                powmod(add(i, 12345678901234567890), 65537, 340282366920938463463374607431768211507)
+                i = add(i, 1)
+    ''')
+    report('1000x powmod with 128 bit modulus', seconds)
+
+
+
+def bench_dispatch():
+    '''50-branch `if eq(x, ...) elif ...` command dispatcher'''
+    branches = 50
+    calls = 20000
+    dispatcher = '\n'.join(f"    {'if' if i == 0 else 'elif'} eq(command, 'cmd{i}')\n        {i}" for i in range(branches))
+    source = f'''\
+def main()
+    i = 0
+    while lt(i, {calls // 2})
+        dispatch('cmd0')
+        dispatch('cmd{branches - 1}')
+        i = add(i, 1)
+def dispatch(command)
+{dispatcher}
+    else
+        sub(0, 1)
+'''
+    general = run_program(source, interpreter=Interpreter(optimize=False))
+    report(f'{calls} dispatches, if/elif chain', general)
+    dispatched = run_program(source)
+    report(f'{calls} dispatches, jump table', dispatched, f'{general / dispatched:.1f}x faster')
+
+
+
+def bench_run_many():
+    '''compile `examples/greet.asdf` once and run it many times with different inputs'''
+    runs = 10000
+    with open('examples/greet.asdf', encoding='utf-8') as source_file:
+        tree = parse(source_file.read())
+    inputs = [f'name{i}\n' for i in range(runs)]
+    start = time.perf_counter()
+    for input_text in inputs:
+        with io.StringIO(input_text) as input_stream, io.StringIO() as output_stream:
+            interpret(tree, input_stream, output_stream)
+    recompiled = time.perf_counter() - start
+    report(f'{runs} runs, compiled every run', recompiled)
+    start = time.perf_counter()
+    program = compile(tree)
+    for input_text in inputs:
+        with io.StringIO(input_text) as input_stream, io.StringIO() as output_stream:
+            program(input_stream, output_stream)
+    compiled = time.perf_counter() - start
+    report(f'{runs} runs, compiled once', compiled, f'{recompiled / compiled:.1f}x faster')
+
+
+
+def bench_inline():
+    '''call-heavy loop of small helper functions, with and without inlining'''
+    calls = 100000
+    source = f'''\
+        def main()
+            i = 0
+            while lt(i, {calls})
+                i = inc(i)
+        def inc(x)
+            add(x, one())
+        def one()
+            1
+    '''
+    called = run_program(source, interpreter=Interpreter(inline_threshold=0))
+    report(f'{calls} x 2 calls, not inlined', called)
+    inlined = run_program(source)
+    report(f'{calls} x 2 calls, inlined', inlined, f'{called / inlined:.2f}x faster')
+
+
+
+def bench_counting_loop():
+    '''counting loops `while lt(i, N)` with `i = add(i, 1)`, general and specialized'''
+    def loop(n : int, body : str) -> str:
+        return f'''\
+            def main()
+                i = 0
+                s = 0
+                while lt(i, {n})
+                    {body}
+                    i = add(i, 1)
+        '''
+    # the general loop is only run for the smallest count, as it takes too long otherwise
+    for n in (10**6, 10**7, 10**8):
+        if n <= 10**6:
+            report(f'{n:.0e} iterations, `s = add(s, i)`, general', run_program(loop(n, 's = add(s, i)'), interpreter=Interpreter(optimize=False)))
+        report(f'{n:.0e} iterations, `s = add(s, i)`, specialized', run_program(loop(n, 's = add(s, i)')))
+    # a loop which only increments the counter is skipped directly to the end
+    report(f'{10**8:.0e} iterations, empty body, specialized', run_program(loop(10**8, '')))
+
+
+
+def bench_pmap():
+    '''`pmap` of a pure function over many inputs, scaling over the number of worker processes'''
+    tasks = 32
+    def program(run : str) -> str:
+        return f'''\
+            def main()
+                inputs = {{}}
+                i = 0
+                while lt(i, {tasks})
+                    put(inputs, i, 20000)
+                    i = add(i, 1)
+                {run}
+            def work(n)
+                s = 0
+                j = 0
+                while lt(j, n)
+                    s = add(s, mul(j, j))
+                    j = add(j, 1)
+                s
+            def work_all(inputs)
+                i = 0
+                while lt(i, size(inputs))
+                    work(get(inputs, i))
+                    i = add(i, 1)
+        '''
+    sequential = run_program(program('work_all(inputs)'))
+    report(f'{tasks} calls in a while loop', sequential)
+    cores = os.cpu_count() or 1
+    for workers in sorted({1, cores} | {2**k for k in range(1, cores.bit_length())}):
+        stdlib.pmap_workers = workers
+        seconds = run_program(program('pmap(work, inputs)'))
+        report(f'{tasks} calls with pmap, {workers} workers', seconds, f'{sequential / seconds:.2f}x faster')
+    stdlib.pmap_workers = None
+
+
+
+def bench_strings():
+    '''build large outputs from 100 character pieces, by reformatting, with `concat` and with a builder'''
+    def build(megabytes : int, step : str, start : str = "''") -> str:
+        return f'''\
+            def main()
+                piece = '{'x' * 99}'
+                out = {start}
+                i = 0
+                while lt(i, {megabytes * 10**4})
+                    {step}
+                    i = add(i, 1)
+                print(out)
+        '''
+    # copying the whole string for every piece is quadratic, so only build small outputs this way
+    for megabytes in (1, 2):
+        report(f'{megabytes} MB, `out = "{{out}}{{piece}}\\n"`', run_program(build(megabytes, 'out = "{out}{piece}\\n"')))
+        report(f'{megabytes} MB, `out = concat(out, piece, ...)`', run_program(build(megabytes, "out = concat(out, piece, '\\n')")))
+    for megabytes in (1, 10, 100):
+        report(f'{megabytes} MB, `append(out, piece, ...)`', run_program(build(megabytes, "append(out, piece, '\\n')", 'builder()')))
+
+
+
+def bench_startup():
+    '''startup time of `python main.py FILE` compared to `python runner.py FILE.asdfc`, which doesn't import lark'''
+    runs = 20
+    start = time.perf_counter()
+    for _ in range(runs):
+        subprocess.run(['python', '-c', 'pass'], check=True)
+    report('python -c pass', (time.perf_counter() - start) / runs)
+    with tempfile.TemporaryDirectory() as directory:
+        for name in ('factorial', 'fox'):
+            artifact = os.path.join(directory, f'{name}.asdfc')
+            subprocess.run(['python', 'main.py', '--compile-to', artifact, f'examples/{name}.asdf'], check=True)
+            source = sum(run_file(f'examples/{name}.asdf', [b'10\n']) for _ in range(runs)) / runs
+            report(f'python main.py examples/{name}.asdf', source)
+            compiled = sum(run_file(artifact, [b'10\n'], 'runner.py') for _ in range(runs)) / runs
+            report(f'python runner.py {name}.asdfc', compiled, f'{source / compiled:.1f}x faster')
+
+
+
+BENCHMARKS : dict[str, Callable[[], None]] = {
+    'streaming': bench_streaming,
+    'bigint': bench_bigint,
+    'dispatch': bench_dispatch,
+    'run_many': bench_run_many,
+    'inline': bench_inline,
+    'counting_loop': bench_counting_loop,
+    'pmap': bench_pmap,
+    'strings': bench_strings,
+    'startup': bench_startup,
+}
+
+
+def main() -> None:
+    '''run the benchmarks given as command line arguments, or all of them'''
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f'unknown benchmark: {name}, available: {", ".join(BENCHMARKS)}', file=sys.stderr)
+            sys.exit(1)
+    for name in names:
+        print(f'{name}: {BENCHMARKS[name].__doc__}')
+        BENCHMARKS[name]()
+
+
+
+if __name__ == '__main__':
+    main()
@@ -1,50 +1,243 @@
 '''
-provide an `interpret` function for interpreting parsed source code.
-It uses the Lark.visitors.Interpreter class as a base and is therefore
-more concise and extensible, but typing support is limited.
+provide a `compile` function for compiling parsed source code into a `Program`,
+which can be run many times, and an `interpret` function to compile and run it once.
+The syntax tree is only accessed through the attributes of the lark `Tree` and
+`Token` classes, without importing lark, so that programs loaded from `.asdfc`
+artifacts (see `artifact.py`) can be run without it.
 
 author: Jonas Loos (2023)
 '''
 
 # pylint: disable=missing-function-docstring
 
-from typing import Any, Callable, Optional, TextIO
-from lark import Token, Tree
-from lark.visitors import Interpreter as LarkInterpreter
+from __future__ import annotations
+import re
+import string
+from typing import TYPE_CHECKING, Any, Callable, Iterator, Optional, Sequence, TextIO
 import stdlib
-from stdlib import Object, Value, Function, Fail, std_names
+from stdlib import Object, Value, Map, share, release, Function, StdFunction, Fail, std_names, is_int, is_tree
+
+if TYPE_CHECKING:
+    from lark import Token, Tree
 
 TODO = ...  # placeholder
 
+Position = tuple[int, int]  # line and column in the source code
+
 
 class DefinedFunction(Function):
     '''Function defined in the source code'''
+    program : Optional['Program'] = None  # the program the function belongs to, e.g. for running it in other processes
+
     def __call__(self, names : dict[str, Object], *args : Value) -> Object:
         '''TODO remove if Function is adjusted'''
         return self.fun(names, *args)
 
 
+class CallSite:
+    '''inline cache of a single call site, remembering the resolved function and the namespace version it was resolved in'''
+    def __init__(self, name : str):
+        self.name = name
+        self.func : Optional[Function] = None
+        self.version = -1  # never matches a valid namespace version
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return f'CallSite({self.name}, hits={self.hits}, misses={self.misses})'
+
+
+class FunctionInfo:
+    '''static information about a defined function, collected before compiling, used for inlining'''
+    def __init__(self, function_def : Tree):
+        name, arg_names, body = function_def.children
+        self.name = name
+        self.arg_names : list[str] = list(arg_names.children)  # type: ignore[arg-type]
+        self.size = sum(1 for _ in subtrees(body))
+        self.calls : set[str] = {tree.children[0] for tree in subtrees(body) if tree.data == 'funccall'}  # type: ignore[misc]
+        self.reads : Optional[set[str]] = read_names(body)
+        self.run_body : Optional[Callable[..., Object]] = None  # set when the function is compiled
+        # global names used by the function and the functions it calls, None if it might use names of its caller
+        self.scope : Optional[dict[str, Object]] = None  # set when the program is compiled
+
+    def __repr__(self):
+        return f'FunctionInfo({self.name}, size={self.size})'
+
+
+class Hooks:
+    '''
+    base class for execution hooks, override the methods of the events of interest.
+    Every event gets the source position of the code which caused it.
+    '''
+
+    def function_enter(self, name : str, args : tuple[Object, ...], position : Position) -> None:
+        '''called before a defined function is run'''
+
+    def function_exit(self, name : str, result : Object, position : Position) -> None:
+        '''called after a defined function returned'''
+
+    def function_error(self, name : str, error : BaseException, position : Position) -> None:
+        '''called instead of `function_exit` if a defined function raised an error'''
+
+    def statement(self, position : Position) -> None:
+        '''called before a statement of a function body is executed'''
+
+    def assignment(self, name : str, value : Object, position : Position) -> None:
+        '''called after a value was assigned to a name'''
+
+    def builtin_call(self, name : str, args : list[Object], result : Object, position : Position) -> None:
+        '''called after a function of the standard-library returned'''
+
+
 
-def interpret(program : Tree, input_steam : Optional[TextIO] = None, output_stream : Optional[TextIO] = None) -> None:
-    '''main entry point - interpret the given program '''
-    # set input and output stream
-    if input_steam:
-        stdlib.input_stream = input_steam
-    if output_stream:
-        stdlib.output_stream = output_stream
+class Program:
+    '''a compiled program, which can be run many times without compiling it again'''
+    def __init__(self, tree : Tree, interpreter : 'Interpreter'):
+        self.tree = tree
+        self.interpreter = interpreter
+        self.main : Callable[[], Object] = interpreter.visit(tree)
+        for function in interpreter.global_names.values():
+            if isinstance(function, DefinedFunction):
+                function.program = self
 
-    # run program
-    main = Interpreter().visit(program)
-    main()
+    def __repr__(self):
+        return f'Program({len(self.tree.children)} functions)'
 
+    def __reduce__(self):
+        # compiled closures can't be pickled, so compile the program again when unpickling, e.g. in a worker process
+        return compile, (self.tree,)
 
+    def call(self, name : str, *args : Object) -> Object:
+        '''call a function of the program in the global namespace'''
+        return self.interpreter.global_names[name](self.interpreter.global_names, *args)  # type: ignore[operator]
 
-class Interpreter(LarkInterpreter):
+    def __call__(self, input_stream : Optional[TextIO] = None, output_stream : Optional[TextIO] = None) -> None:
+        '''run the program, optionally with the given input and output streams'''
+        previous_streams = stdlib.input_stream, stdlib.output_stream
+        if input_stream:
+            stdlib.input_stream = input_stream
+        if output_stream:
+            stdlib.output_stream = output_stream
+        try:
+            self.main()
+        finally:
+            stdlib.input_stream, stdlib.output_stream = previous_streams
+
+
+def compile(tree : Tree, interpreter : Optional['Interpreter'] = None) -> Program:  # pylint: disable=redefined-builtin
+    '''compile the given program once, optionally using the given `interpreter` instance'''
+    return Program(tree, interpreter or Interpreter())
+
+
+def interpret(program : Tree, input_steam : Optional[TextIO] = None, output_stream : Optional[TextIO] = None, interpreter : Optional['Interpreter'] = None) -> None:
+    '''main entry point - compile and run the given program, optionally using the given `interpreter` instance'''
+    compile(program, interpreter)(input_steam, output_stream)
+
+
+
+class Interpreter:  # pylint: disable=too-many-public-methods,too-many-instance-attributes
     '''class for interpreting a program'''
 
+    def __init__(self, hooks : Optional[Hooks] = None, optimize : bool = True, inline_threshold : int = 32):
+        # instrumentation is only compiled in if hooks are given
+        self.hooks = hooks
+        # optimizations which change the structure of the compiled code, disabled when tracing
+        self.optimize = optimize and not hooks
+        # functions with bodies of at most this many nodes are inlined at their call sites
+        self.inline_threshold = inline_threshold
+        # version stamp of the global namespace, call sites resolved against an older version are stale
+        self.version = 0
+        # names which can be rebound at runtime, call sites of these names can't be cached
+        self.bound_names : set[str] = {'_'}
+        # global namespace of the compiled program
+        self.global_names : dict[str, Object] = {}
+        # defined functions, collected before compiling
+        self.functions : dict[str, FunctionInfo] = {}
+        # inline caches of all call sites, in order of compilation
+        self.call_sites : list[CallSite] = []
+
+    def visit(self, tree : Tree) -> Any:
+        '''compile the tree with the method named like its rule'''
+        return getattr(self, tree.data)(tree)
+
+    def visit_children(self, tree : Tree) -> list:
+        '''compile the subtrees of the tree, tokens are returned unchanged'''
+        return [self.visit(child) if is_tree(child) else child for child in tree.children]
+
+    def cache_stats(self) -> dict[str, tuple[int, int]]:
+        '''return the number of inline cache hits and misses, summed up per function name'''
+        stats : dict[str, tuple[int, int]] = {}
+        for site in self.call_sites:
+            hits, misses = stats.get(site.name, (0, 0))
+            stats[site.name] = hits + site.hits, misses + site.misses
+        return stats
+
+    def analyze(self, program : Tree) -> None:
+        '''collect the defined functions and all names which can be rebound, before compiling the program'''
+        for function_def in program.children:
+            info = FunctionInfo(function_def)  # type: ignore[arg-type]
+            self.functions[info.name] = info  # later definitions replace earlier ones
+            self.bound_names.update(info.arg_names)
+        self.bound_names.update(tree.children[0] for tree in subtrees(program) if tree.data == 'assignment')  # type: ignore[misc]
+
+    def recursive(self, name : str) -> bool:
+        '''check if the defined function can call itself through calls of other defined functions'''
+        todo, seen = [name], set()
+        while todo:
+            for callee in self.functions[todo.pop()].calls:
+                if callee == name:
+                    return True
+                if callee in self.functions and callee not in self.bound_names and callee not in seen:
+                    seen.add(callee)
+                    todo.append(callee)
+        return False
+
+    def inline_target(self, name : str, n_args : int) -> Optional[FunctionInfo]:
+        '''return the function to inline at a call site, or None if it shouldn't be inlined'''
+        if not self.optimize or name in self.bound_names or name not in self.functions:
+            return None
+        info = self.functions[name]
+        if info.size > self.inline_threshold or n_args != len(info.arg_names) or self.recursive(name):
+            return None
+        return info
+
+    def used_globals(self, name : str) -> Optional[set[str]]:
+        '''
+        return the global names used by the defined function and the functions it calls,
+        or None if it might use names of its caller, which are visible to it as the scoping is dynamic
+        '''
+        used : set[str] = set()
+        todo, seen = [name], {name}
+        while todo:
+            info = self.functions[todo.pop()]
+            if info.reads is None:
+                return None
+            # arguments can be read, but calling them could run a function which uses names of the caller
+            for read in info.reads - set(info.arg_names) - {'_'}:
+                if read in self.bound_names:
+                    return None
+                used.add(read)
+            for callee in info.calls:
+                if callee in self.bound_names:
+                    return None
+                used.add(callee)
+                if callee in self.functions and callee not in seen:
+                    seen.add(callee)
+                    todo.append(callee)
+        return used
+
     def program(self, program : Tree) -> Callable:
+        # forget the functions and call sites of previously compiled programs
+        self.bound_names, self.functions, self.call_sites = {'_'}, {}, []
+        self.analyze(program)
         # go through whole program and add global function definitions to global names
-        global_names : dict[str, Object] = std_names | dict(self.visit_children(program))
+        global_names = self.global_names = std_names | dict(self.visit_children(program))
+        # functions which only use their arguments and global names can be run without the names of their caller
+        for name, info in self.functions.items():
+            if (used := self.used_globals(name)) is not None:
+                info.scope = {used_name: global_names[used_name] for used_name in used if used_name in global_names}
+        # a new global namespace invalidates all inline caches
+        self.version += 1
         # run main function
         if 'main' not in global_names:
             raise Fail('main Function not defined')
@@ -55,25 +248,47 @@ class Interpreter(LarkInterpreter):
 
     def function_def(self, function_def : Tree) -> tuple[str, DefinedFunction]:
         name, arg_names, run_body = self.visit_children(function_def)
+        if name in self.functions:
+            self.functions[name].run_body = run_body
         def run_function(names, *args):
             # check if the number of given arguments is correct
             n = len(args)
             if n != len(arg_names):
                 raise Fail(f'wrong number of arguments when calling {name}: expected {len(arg_names)}, got {n}')
-            # initialize arguments
-            # only give a copy of `names`, to avoid cluttering the global namespace
-            # set `_` to first argument
-            tmp = names | dict(zip(arg_names, args)) | {'_': args[0] if n > 0 else Value(None)}
-            return run_body(tmp)
+            return run_function_body(run_body, names, arg_names, args)
+        if self.hooks:
+            hooks, pos, run_untraced = self.hooks, source_position(function_def), run_function
+            def run_traced_function(names, *args):
+                hooks.function_enter(name, args, pos)
+                try:
+                    result = run_untraced(names, *args)
+                except BaseException as error:
+                    # keep the enter and exit events balanced
+                    hooks.function_error(name, error, pos)
+                    raise
+                hooks.function_exit(name, result, pos)
+                return result
+            run_function = run_traced_function
         return name, DefinedFunction(name, run_function)
 
     def body(self, body : Tree) -> Callable[..., Object]:
+        return run_statements(self.statements(body))
+
+    def statements(self, body : Tree) -> list[Callable[..., Object]]:
+        '''compile the statements of a body separately'''
         run_stmts = self.visit_children(body)
-        def run_body(names : dict[str, Object]) -> Object:
-            for run_stmt in run_stmts:
-                names['_'] = run_stmt(names)  # `run_stmt` can change `names`
-            return names['_']  # type: ignore
-        return run_body
+        if self.hooks:
+            run_stmts = [self.trace_statement(run_stmt, source_position(stmt)) for run_stmt, stmt in zip(run_stmts, body.children)]
+        return run_stmts
+
+    def trace_statement(self, run_stmt : Callable[..., Object], pos : Position) -> Callable[..., Object]:
+        '''wrap a compiled statement to call the `statement` hook before running it'''
+        hooks = self.hooks
+        assert hooks
+        def run_traced_stmt(names : dict[str, Object]) -> Object:
+            hooks.statement(pos)
+            return run_stmt(names)
+        return run_traced_stmt
 
     def line_stmt(self, line_stmt : Tree) -> Callable[..., Object]:
         return self.visit_children(line_stmt)[0]
@@ -82,10 +297,9 @@ class Interpreter(LarkInterpreter):
         return self.visit_children(multiline_stmt)[0]
 
     def do_stmt(self, do_stmt : Tree) -> Callable[..., Object]:
-        def run_do(names : dict[str, Object]) -> Object:
-            # if block level variable scoope is desired, use `{**names}`, otherwise use `names`
-            return self.visit_children(do_stmt)[0](names)
-        return run_do
+        # if block level variable scoope is desired, run the body with `{**names}`, otherwise with `names`
+        run_body, = self.visit_children(do_stmt)
+        return run_body
 
     def if_stmt(self, if_stmt : Tree) -> Callable[..., Object]:
         if_condition, if_body, elifs, else_stmt = self.visit_children(if_stmt)
@@ -96,8 +310,46 @@ class Interpreter(LarkInterpreter):
                 if test_result.value:  # use python truthiness
                     return stmt_body(names)
             return else_stmt(names)
+        if self.optimize:
+            return self.dispatch_table(if_stmt, conditions, else_stmt, run_if) or run_if
         return run_if
 
+    def dispatch_table(self, if_stmt : Tree, conditions : list[tuple[Callable,Callable]], else_stmt : Callable, run_if : Callable) -> Optional[Callable[..., Object]]:
+        '''
+        compile an if/elif chain where every condition is `eq(<same name>, <literal>)` into a dict lookup.
+        Returns None if the chain doesn't have this form.
+        '''
+        condition_trees = [if_stmt.children[0], *(elif_stmt.children[0] for elif_stmt in if_stmt.children[2].children)]
+        if len(condition_trees) < 2:
+            return None
+        subject = None
+        table : dict[Any, Callable] = {}
+        for condition_tree, (_, stmt_body) in zip(condition_trees, conditions):
+            call = condition_tree.children[0]
+            if call.data != 'funccall' or call.children[0] != 'eq' or len(call.children[1].children) != 2:
+                return None
+            name_tree, constant_tree = call.children[1].children
+            name, constant = name_of(name_tree), literal(constant_tree)
+            if name is None or constant is None or subject not in (None, name):
+                return None
+            subject = name
+            try:
+                table.setdefault(constant.value, stmt_body)  # the first matching branch is taken
+            except TypeError:
+                return None
+        eq = std_names['eq']
+        def run_dispatch(names : dict[str, Object]) -> Object:
+            # only valid as long as `eq` is the builtin and the subject is a hashable value
+            if names.get('eq') is eq and isinstance(value := names.get(subject), Value):  # type: ignore[arg-type]
+                try:
+                    stmt_body = table.get(value.value)
+                except TypeError:
+                    pass
+                else:
+                    return (stmt_body or else_stmt)(names)
+            return run_if(names)
+        return run_dispatch
+
     def elifs(self, elifs : Tree) -> list[tuple[Callable,Callable]]:
         return self.visit_children(elifs)
 
@@ -110,29 +362,130 @@ class Interpreter(LarkInterpreter):
         return tmp[0] if tmp else lambda _: Value(None)
 
     def while_stmt(self, while_stmt : Tree) -> Callable[..., Object]:
-        condition, body = self.visit_children(while_stmt)
+        condition_tree, body_tree = while_stmt.children
+        condition = self.visit(condition_tree)
+        run_stmts = self.statements(body_tree)
+        body = run_statements(run_stmts)
         def run_while(names : dict[str, Object]) -> Object:
             returnValue = Value(None)
             while condition(names).value:
                 returnValue = body(names)
             # TODO: return list of all return values instead of the last one
             return returnValue
+        if self.optimize:
+            return self.counting_loop(while_stmt, run_stmts, run_while) or run_while
         return run_while
 
+    def is_builtin(self, name : str) -> bool:
+        '''check if the name always refers to the function of the standard-library, i.e. it is neither defined nor assigned'''
+        return name in std_names and name not in self.functions and name not in self.bound_names
+
+    def counting_loop(self, while_stmt : Tree, run_stmts : list[Callable[..., Object]], run_while : Callable) -> Optional[Callable[..., Object]]:
+        '''
+        compile a loop of the form `while lt(i, N)` with a single `i = add(i, <constant>)` statement in its body
+        into a python `range` loop, as long as `N` isn't changed in the body.
+        Also works with `leq` and with `gt`/`geq` and `sub`.
+        Returns None if the loop doesn't have this form.
+        '''
+        condition_tree, body_tree = while_stmt.children
+        # condition: `lt(i, N)`, where N is a constant or a name
+        call = condition_tree.children[0]
+        if call.data != 'funccall' or call.children[0] not in COUNTING_COMPARISONS or not self.is_builtin(call.children[0]) or len(call.children[1].children) != 2:
+            return None
+        increment_name, inclusive = COUNTING_COMPARISONS[call.children[0]]
+        counter_tree, bound_tree = call.children[1].children
+        counter, bound_name, bound = name_of(counter_tree), name_of(bound_tree), literal(bound_tree)
+        if counter is None or counter == '_' or counter in std_names or bound_name == '_' or not (bound_name or (bound and is_int(bound.value))):
+            return None
+        # body: exactly one assignment to the counter, which is a top level increment, and no assignment to the bound
+        assigned = [tree.children[0] for tree in subtrees(body_tree) if tree.data == 'assignment']
+        if assigned.count(counter) != 1 or bound_name in assigned:
+            return None
+        for index, stmt in enumerate(body_tree.children):
+            assignment = stmt.children[0]
+            if assignment.data == 'assignment' and assignment.children[0] == counter:
+                break
+        else:
+            return None
+        increment = assignment.children[1].children[0]
+        if increment.data != 'funccall' or increment.children[0] != increment_name or not self.is_builtin(increment_name) or len(increment.children[1].children) != 2:
+            return None
+        step_counter, step_tree = increment.children[1].children
+        step = literal(step_tree)
+        if name_of(step_counter) != counter or step is None or not is_int(step.value) or step.value <= 0:
+            return None
+        step_value = step.value if increment_name == 'add' else -step.value
+        before, after = run_stmts[:index], run_stmts[index+1:]
+
+        def run_counting_loop(names : dict[str, Object]) -> Object:
+            start = names.get(counter)
+            stop = names.get(bound_name) if bound_name else bound  # type: ignore[arg-type]
+            if not isinstance(start, Value) or not is_int(start.value) or not isinstance(stop, Value) or not is_int(stop.value):
+                return run_while(names)
+            values = range(start.value, stop.value + (1 if step_value > 0 else -1) * inclusive, step_value)
+            if not values:
+                return Value(None)
+            if not before and not after:
+                # the body only increments the counter, so skip directly to the end
+                names['_'] = names[counter] = result = Value(values[-1] + step_value)
+                return result
+            for value in values:
+                for run_stmt in before:
+                    names['_'] = run_stmt(names)
+                names['_'] = names[counter] = Value(value + step_value)
+                for run_stmt in after:
+                    names['_'] = run_stmt(names)
+            return names['_']
+        return run_counting_loop
+
     def funccall(self, funccall : Tree) -> Callable[..., Object]:
         name, arguments = self.visit_children(funccall)
-        assert isinstance(name, Token)
-        def run_funccall(names : dict[str, Object]) -> Object:
+        assert isinstance(name, str)
+        if target := self.inline_target(name, len(arguments)):
+            arg_names = target.arg_names
+            def run_inlined_call(names : dict[str, Object]) -> Object:
+                # run the body of the function directly, the argument count was already checked
+                args = [arg(names) for arg in arguments]
+                # if the function can't see the names of the caller, only the global names it uses are copied
+                scope = target.scope
+                return run_function_body(target.run_body, names if scope is None else scope, arg_names, args)  # type: ignore[arg-type]
+            return run_inlined_call
+        site = CallSite(name)
+        self.call_sites.append(site)
+        def resolve(names : dict[str, Object]) -> Function:
+            # slow path: look up the function
+            site.misses += 1
             if name not in names:
                 raise Fail(f'call of undefined function: {name}', funccall)
             func = names[name]
             if not isinstance(func, Function):
                 # a non-Function object was called
                 raise Fail(f'call of {type(func)} object: {name}', funccall)
+            # names which are never assigned or used as argument always refer to the global definition
+            if name not in self.bound_names:
+                site.func, site.version = func, self.version
+            return func
+        def run_funccall(names : dict[str, Object]) -> Object:
+            if site.version == self.version:
+                # fast path: use the cached function
+                site.hits += 1
+                func = site.func
+            else:
+                func = resolve(names)
             # evaluate arguments
             args = [arg(names) for arg in arguments]
             # call the function
             return func(names, *args)  # TODO: adjust Function class in `stdlib.py`
+        if self.hooks:
+            hooks, pos = self.hooks, source_position(funccall)
+            def run_traced_funccall(names : dict[str, Object]) -> Object:
+                func = resolve(names)
+                args = [arg(names) for arg in arguments]
+                result = func(names, *args)
+                if isinstance(func, StdFunction):
+                    hooks.builtin_call(name, args, result, pos)
+                return result
+            return run_traced_funccall
         return run_funccall
 
     def comma_list(self, comma_list : Tree) -> list[Callable]:
@@ -145,46 +498,180 @@ class Interpreter(LarkInterpreter):
                 raise Fail(f'Cannot overwrite a predefined function or value `{name}`', assignment)
             result = names[name] = run_value(names)
             return result
+        if self.hooks:
+            hooks, pos, run_untraced = self.hooks, source_position(assignment), run_assignment
+            def run_traced_assignment(names : dict[str, Object]) -> Object:
+                result = run_untraced(names)
+                hooks.assignment(name, result, pos)
+                return result
+            return run_traced_assignment
         return run_assignment
 
+    def map_literal(self, map_literal : Tree) -> Callable[..., Object]:
+        items, = self.visit_children(map_literal)
+        def run_map_literal(names : dict[str, Object]) -> Object:
+            table = {}
+            for run_key, run_value in items:
+                table[stdlib.map_key(run_key(names), 'map literal', map_literal)] = share(run_value(names))
+            return Map(table)
+        return run_map_literal
+
+    def map_item(self, map_item : Tree) -> tuple[Callable,Callable]:
+        key, value = self.visit_children(map_item)
+        return key, value
+
     def thing(self, thing : Tree) -> Callable[..., Object]:
         value, = thing.children
-        assert isinstance(value, Token)
+        assert isinstance(value, str)
+        if value.type in NUMBER_TYPES:
+            # numbers are constant, so convert them only once
+            constant = Value(parse_number(value))
+            return lambda names: constant
+        if value.type in ('STRING', 'LONG_STRING'):
+            quotes = 1 if value.type == 'STRING' else 3
+            content = value[quotes:-quotes]
+            # if it's a format string, format it, otherwise the string is constant
+            if value[0] == '"':
+                return format_string(value, content)
+            constant = Value(content)
+            return lambda names: constant
+        if value.type != 'NAME':
+            # if grammar and interpreter are correct, this point should never be reached
+            raise Exception(f'unknown thing type: {value.type}')
         def run_thing(names : dict[str, Object]) -> Object:
-            match value.type:
-                case 'NAME':
-                    if value not in names:
-                        raise Fail(f'Use of undefined name `{value}`', value)
-                    return names[value]
-                case "STRING":
-                    # if it's a format string, format it
-                    if value[0] == '"':
-                        try:
-                            return Value(value[1:-1].format(**get_values(names)))
-                        except KeyError as err:
-                            raise Fail(f'Could not find variable {err} used in format string {value}', value) from err
-                    # otherwise return just the content
-                    return Value(value[1:-1])
-                case "LONG_STRING":
-                    # if it's a format string, format it
-                    if value[0] == '"':
-                        try:
-                            return Value(value[3:-3].format(**get_values(names)))
-                        except KeyError as err:
-                            raise Fail(f'Could not find variable {err} used in format string {value}', value) from err
-                    # otherwise return just the content
-                    return Value(value[3:-3])
-                case "DEC_NUMBER":
-                    return Value(int(value))
-                case "HEX_NUMBER" | "BIN_NUMBER" | "OCT_NUMBER" | "FLOAT_NUMBER" | "IMAG_NUMBER":
-                    raise Fail(f'{value.type} is not implemented yet', value)
-                # error
-                case _:
-                    # if grammar and interpreter are correct, this point should never be reached
-                    raise Exception(f'unknown thing type: {value.type}')
+            if value not in names:
+                raise Fail(f'Use of undefined name `{value}`', value)
+            return names[value]
         return run_thing
 
 
-def get_values(names : dict[str, Object]) -> dict[str, Any]:
-    '''filter names dict for Values and extract their internal value'''
-    return {key: value.value for key, value in names.items() if isinstance(value, Value)}
+# comparison functions of counting loops, with the function used for the increment and whether the bound is inclusive
+COUNTING_COMPARISONS = {'lt': ('add', False), 'leq': ('add', True), 'gt': ('sub', False), 'geq': ('sub', True)}
+
+
+def name_of(line_stmt : Tree) -> Optional[Token]:
+    '''return the name if the statement consists of just a name, otherwise None'''
+    thing = line_stmt.children[0]
+    if thing.data == 'thing' and thing.children[0].type == 'NAME':
+        return thing.children[0]
+    return None
+
+
+def literal(line_stmt : Tree) -> Optional[Value]:
+    '''return the value if the statement is a constant number or string, otherwise None'''
+    thing = line_stmt.children[0]
+    if thing.data != 'thing':
+        return None
+    token = thing.children[0]
+    if token.type in NUMBER_TYPES:
+        return Value(parse_number(token))
+    if token.type in ('STRING', 'LONG_STRING'):
+        quotes = 1 if token.type == 'STRING' else 3
+        # format strings are only constant if they don't contain any replacement fields
+        if token[0] != '"' or not ('{' in token or '}' in token):
+            return Value(token[quotes:-quotes])
+    return None
+
+
+NUMBER_TYPES = {'DEC_NUMBER', 'HEX_NUMBER', 'BIN_NUMBER', 'OCT_NUMBER', 'FLOAT_NUMBER', 'IMAG_NUMBER'}
+
+def parse_number(token : Token) -> int | float | complex:
+    '''convert a number literal into the python number'''
+    try:
+        match token.type:
+            case 'DEC_NUMBER':
+                return int(token)
+            case 'HEX_NUMBER' | 'BIN_NUMBER' | 'OCT_NUMBER':
+                return int(token, 0)  # the base is given by the prefix
+            case 'FLOAT_NUMBER':
+                return float(token)
+            case 'IMAG_NUMBER':
+                return complex(token[:-1] + 'j')  # python only accepts `j` as imaginary unit
+            case _:
+                # if grammar and interpreter are correct, this point should never be reached
+                raise Exception(f'unknown number type: {token.type}')
+    except ValueError as err:
+        raise Fail(f'invalid number `{token}`', token) from err
+
+
+def format_fields(content : str) -> set[str]:
+    '''names of the variables used in a format string, including the ones nested in format specs like `{x:>{width}}`'''
+    fields = set()
+    for _, field, spec, _ in string.Formatter().parse(content):
+        if field:
+            fields.add(re.match(r'[^.[]*', field)[0])  # type: ignore[index]
+        if spec and '{' in spec:
+            fields |= format_fields(spec)
+    return fields
+
+
+def read_names(body : Tree) -> Optional[set[str]]:
+    '''names read in the body, including the ones used in format strings, or None if a format string is invalid'''
+    names = set()
+    for tree in subtrees(body):
+        if tree.data != 'thing':
+            continue
+        token, = tree.children
+        if token.type == 'NAME':  # type: ignore[union-attr]
+            names.add(str(token))
+        elif token.type in ('STRING', 'LONG_STRING') and token[0] == '"':  # type: ignore[union-attr,index]
+            quotes = 1 if token.type == 'STRING' else 3  # type: ignore[union-attr]
+            try:
+                names |= format_fields(token[quotes:-quotes])  # type: ignore[index]
+            except ValueError:
+                return None
+    return names
+
+
+def format_string(token : Token, content : str) -> Callable[..., Object]:
+    '''compile a format string, only the variables used in it are looked up when formatting'''
+    try:
+        fields = format_fields(content)
+    except ValueError as err:
+        raise Fail(f'Invalid format string {token}: {err}', token) from err
+    def run_format_string(names : dict[str, Object]) -> Object:
+        values = {name: names[name].print() for name in fields if isinstance(names.get(name), Value)}  # type: ignore[attr-defined]
+        try:
+            return Value(content.format(**values))
+        except KeyError as err:
+            raise Fail(f'Could not find variable {err} used in format string {token}', token) from err
+    return run_format_string
+
+
+def run_statements(run_stmts : list[Callable[..., Object]]) -> Callable[..., Object]:
+    '''combine compiled statements into a body, which returns the result of the last statement'''
+    def run_body(names : dict[str, Object]) -> Object:
+        for run_stmt in run_stmts:
+            names['_'] = run_stmt(names)  # `run_stmt` can change `names`
+        return names['_']  # type: ignore
+    return run_body
+
+
+def run_function_body(run_body : Callable[..., Object], names : dict[str, Object], arg_names : list[str], args : Sequence[Object]) -> Object:
+    '''run the body of a function in a new namespace with the arguments initialized'''
+    # maps and builders are passed by value, but their content is only copied if the function modifies it
+    args = [share(arg) for arg in args]
+    # only give a copy of `names`, to avoid cluttering the global namespace
+    # set `_` to first argument
+    result = run_body(names | dict(zip(arg_names, args)) | {'_': args[0] if args else Value(None)})
+    # the arguments can only be used after the call if they are returned, as maps and builders are only stored as copies
+    for arg in args:
+        if arg is not result:
+            release(arg, result)
+    return result
+
+
+def subtrees(tree : Tree) -> Iterator[Tree]:
+    '''iterate over the tree and all its subtrees'''
+    yield tree
+    for child in tree.children:
+        if is_tree(child):
+            yield from subtrees(child)
+
+
+def source_position(item : Tree | Token) -> Position:
+    '''determine the source position of the first token of `item`'''
+    while is_tree(item):
+        item = item.children[0]
+    assert item.line is not None and item.column is not None
+    return item.line, item.column
@@ -8,7 +8,8 @@ import sys
 
 from parsing import ParserError, parse
 from stdlib import Fail as InterpreterError
-from interpreter import interpret
+from interpreter import interpret, compile  # pylint: disable=redefined-builtin
+from artifact import save
 
 
 
@@ -19,17 +20,22 @@ def fail(msg):
 
 
 def main() -> None:
-    '''parse and interpret the source code file specified as a command line argument'''
+    '''parse and interpret the source code file specified as a command line argument, or compile it into an artifact'''
     # check command line args
-    if len(sys.argv) != 2:
-        fail(f'USAGE: python {sys.argv[0]} FILE')
+    args = sys.argv[1:]
+    output_filename = None
+    if len(args) == 3 and args[0] == '--compile-to':
+        _, output_filename, *args = args
+    if len(args) != 1:
+        fail(f'USAGE: python {sys.argv[0]} [--compile-to FILE.asdfc] FILE')
+    input_filename, = args
 
     # open source code file
     try:
-        with open(sys.argv[1], encoding='utf-8') as input_file:
+        with open(input_filename, encoding='utf-8') as input_file:
             input_text = input_file.read()
     except FileNotFoundError:
-        fail(f'File not found: {sys.argv[1]}')
+        fail(f'File not found: {input_filename}')
 
     # init error class
     InterpreterError.init_class(input_text)
@@ -38,9 +44,17 @@ def main() -> None:
     # print(parse(input_text).pretty())
     # print('-'*50)
 
-    # run parser and interpreter
+    # run parser and interpreter, or save the compiled program to be run with `runner.py`
     try:
-        interpret(parse(input_text))
+        program = parse(input_text)
+        if output_filename is None:
+            interpret(program)
+        else:
+            compile(program)  # report errors already when compiling
+            try:
+                save(output_filename, program, input_text)
+            except OSError as error:
+                fail(f'Could not write {output_filename}: {error}')
     except (ParserError, InterpreterError) as error:
         fail(error)
     except KeyboardInterrupt:
@@ -17,8 +17,8 @@ class ParserError(Exception):
 class TreeIndenter(Indenter):
     '''helper class for indentation parsing'''
     NL_type : str = '_NEWLINE'
-    OPEN_PAREN_types : list = []
-    CLOSE_PAREN_types : list = []
+    OPEN_PAREN_types : list = ['LBRACE']  # allow map literals to span multiple lines
+    CLOSE_PAREN_types : list = ['RBRACE']
     INDENT_type : str = '_INDENT'
     DEDENT_type : str = '_DEDENT'
     tab_len : int = 8
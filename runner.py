@@ -0,0 +1,58 @@
+'''
+run precompiled `.asdfc` artifacts, without parsing and without importing lark.
+
+usage:
+
+```
+python main.py --compile-to FILE.asdfc FILE
+python runner.py FILE.asdfc
+```
+
+author: Jonas Loos (2023)
+'''
+
+# pylint: disable=duplicate-code
+
+import sys
+
+from stdlib import Fail as InterpreterError
+from interpreter import interpret
+from artifact import ArtifactError, load
+
+
+
+def fail(msg):
+    '''print error message and exit'''
+    print(msg, file=sys.stderr)
+    sys.exit(1)
+
+
+def main() -> None:
+    '''load and interpret the artifact file specified as a command line argument'''
+    # check command line args
+    if len(sys.argv) != 2:
+        fail(f'USAGE: python {sys.argv[0]} FILE.asdfc')
+
+    # load artifact file
+    try:
+        program, source = load(sys.argv[1])
+    except FileNotFoundError:
+        fail(f'File not found: {sys.argv[1]}')
+    except ArtifactError as error:
+        fail(error)
+
+    # init error class
+    InterpreterError.init_class(source)
+
+    # run interpreter
+    try:
+        interpret(program)
+    except InterpreterError as error:
+        fail(error)
+    except KeyboardInterrupt:
+        fail('KeyboardInterrupt')
+
+
+
+if __name__ == '__main__':
+    main()
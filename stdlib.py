@@ -4,16 +4,40 @@ This class contains the implementations of the functions in the standard-library
 author: Jonas Loos (2022)
 '''
 
+from __future__ import annotations
+import os
 import sys
-from typing import Any, Callable
-from lark.lexer import Token
-from lark.tree import Tree
+import math
+import atexit
+from functools import partial
+from typing import TYPE_CHECKING, Any, Callable, Optional, TextIO
+
+if TYPE_CHECKING:
+    from lark import Token, Tree
+
+# optional backend for faster big integer arithmetic
+try:
+    import gmpy2
+except ImportError:
+    gmpy2 = None
 
 
 # define default input/output streams
 input_stream = sys.stdin
 output_stream = sys.stdout
 
+# allow converting big integers (e.g. large factorials) to strings
+if hasattr(sys, 'set_int_max_str_digits'):
+    sys.set_int_max_str_digits(0)
+
+# integers with more bits than this are multiplied using gmpy2, if it is installed
+gmpy2_threshold = 1 << 14
+
+# number of worker processes and number of calls sent to a worker at once for `pmap`,
+# None uses the environment variables `ASDF_PMAP_WORKERS` and `ASDF_PMAP_CHUNKSIZE` if set, and otherwise chooses automatically
+pmap_workers : Optional[int] = None
+pmap_chunksize : Optional[int] = None
+
 
 ##########
 ########## basic objects
@@ -36,6 +60,93 @@ class Value(Object):
         return self.value
 
 
+class Map(Value):
+    '''
+    hash map from hashable values to objects, its table is shared until one of the sharing maps is modified (copy-on-write).
+    Maps and builders in the table belong to it, they are shared when the table is copied.
+    '''
+    def __init__(self, table : Optional[dict[Any, Object]] = None):
+        super().__init__(table if table is not None else {})
+        self.refs = [1]  # number of maps sharing the table, shared between them
+
+    def __repr__(self):
+        return f'Map({self.value})'
+
+    def share(self) -> 'Map':
+        '''create a map with the same content, without copying the table'''
+        other = Map(self.value)
+        other.refs = self.refs
+        self.refs[0] += 1
+        return other
+
+    def writable(self) -> dict[Any, Object]:
+        '''get the table for modification, copy it first if it's shared with other maps'''
+        if self.refs[0] > 1:
+            self.refs[0] -= 1
+            self.value = {key: share(value) for key, value in self.value.items()}
+            self.refs = [1]
+        return self.value
+
+    def release(self, keep : Optional[Object] = None) -> None:
+        '''stop using this map, the maps and builders in the table are released with the last map using it, except for `keep`'''
+        self.refs[0] -= 1
+        if self.refs[0] == 0:
+            for value in self.value.values():
+                if value is not keep:
+                    release(value, keep)
+
+    def print(self):
+        '''determine how this object should be printed out'''
+        return {key: value.print() for key, value in self.value.items()}  # type: ignore[attr-defined]
+
+
+class Builder(Value):
+    '''string builder, appending is amortized O(1) as the parts are only joined when the string is needed, shared like maps'''
+    def __init__(self, parts : Optional[list[str]] = None):  # pylint: disable=super-init-not-called
+        self.parts = parts if parts is not None else []
+        self.refs = [1]  # number of builders sharing the parts, shared between them
+
+    def __repr__(self):
+        return f'Builder({self.parts})'
+
+    @property
+    def value(self) -> str:  # type: ignore[override]
+        '''the built string, the parts are joined in place so that sharing builders don't join them again'''
+        if len(self.parts) != 1:
+            self.parts[:] = [''.join(self.parts)]
+        return self.parts[0]
+
+    def share(self) -> 'Builder':
+        '''create a builder with the same content, without copying the parts'''
+        other = Builder(self.parts)
+        other.refs = self.refs
+        self.refs[0] += 1
+        return other
+
+    def writable(self) -> list[str]:
+        '''get the parts for appending, copy them first if they are shared with other builders'''
+        if self.refs[0] > 1:
+            self.refs[0] -= 1
+            self.parts = list(self.parts)
+            self.refs = [1]
+        return self.parts
+
+    def release(self, keep : Optional[Object] = None) -> None:  # pylint: disable=unused-argument
+        '''stop using this builder'''
+        self.refs[0] -= 1
+
+
+def share(obj : Object) -> Object:
+    '''return a new map or builder sharing the content with `obj` until one of them is modified, other objects are returned as they are'''
+    return obj.share() if isinstance(obj, (Map, Builder)) else obj
+
+
+def release(obj : Object, keep : Optional[Object] = None) -> None:
+    '''stop using a map or builder returned by `share`, so that the remaining one doesn't have to copy its content when modified'''
+    if isinstance(obj, (Map, Builder)):
+        obj.release(keep)
+
+
 class Function(Object):
     '''basic function object'''
     def __init__(self, name : str, fun : Callable):
@@ -60,6 +171,88 @@ class StdFunction(Function):
 
 
 
+class Lines(Object):
+    '''iterator over the lines of the input, which is true as long as there are lines left'''
+    def __init__(self, buffer : 'InputBuffer'):
+        self.buffer = buffer
+
+    def __repr__(self):
+        return f'Lines({self.buffer.stream})'
+
+    @property
+    def value(self) -> bool:
+        '''used as condition, e.g. in `while`'''
+        return not self.buffer.at_eof()
+
+    def print(self):
+        '''determine how this object should be printed out'''
+        return '<Lines>'
+
+
+
+##########
+########## input buffering
+##########
+
+class InputBuffer:
+    '''read an input stream in bounded pieces, so memory use doesn't depend on the input size'''
+
+    chunk_size = 1 << 16
+
+    def __init__(self, stream : TextIO):
+        self.stream = stream
+        self.buffer = ''
+        self.pos = 0  # start of the unread part of `buffer`
+
+    def fill(self) -> bool:
+        '''read the next line, or the next chunk of a long line, into the buffer, return false at the end of the input'''
+        # reading whole chunks would wait for more input than needed, e.g. from a pipe of an interactive parent process
+        chunk = self.stream.readline(self.chunk_size)
+        if not chunk:
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def at_eof(self) -> bool:
+        '''check if the whole input was read'''
+        return self.pos >= len(self.buffer) and not self.fill()
+
+    def readline(self) -> Optional[str]:
+        '''read the next line without the newline symbol, or None at the end of the input'''
+        start = self.pos
+        while (end := self.buffer.find('\n', start)) < 0:
+            start = len(self.buffer) - self.pos  # don't search the same part again after `fill`
+            if not self.fill():
+                if self.pos >= len(self.buffer):
+                    return None
+                # last line without newline symbol
+                end = len(self.buffer)
+                break
+        line = self.buffer[self.pos:end]
+        self.pos = end + 1
+        return line
+
+    def read(self, n : int) -> str:
+        '''read up to `n` characters, the result is only empty at the end of the input'''
+        if self.pos >= len(self.buffer):
+            self.fill()
+        text = self.buffer[self.pos:self.pos+n]
+        self.pos += len(text)
+        return text
+
+
+_input_buffer : Optional[InputBuffer] = None
+
+def get_input_buffer() -> InputBuffer:
+    '''return the buffer of the current `input_stream`'''
+    global _input_buffer  # pylint: disable=global-statement
+    if _input_buffer is None or _input_buffer.stream is not input_stream:
+        _input_buffer = InputBuffer(input_stream)
+    return _input_buffer
+
+
+
 ##########
 ########## Fail during execution
 ##########
@@ -77,13 +270,12 @@ class Fail(Exception):
     def __init__(self, msg : Any, item : Tree | Token | None = None):
         if item:
             # get first and last token
-            first = last = item
-            while not isinstance(first, Token):
-                assert isinstance(first, Tree)
-                first = first.children[0]
-            while not isinstance(last, Token):
-                assert isinstance(last, Tree)
-                last = last.children[-1]  # TODO: what if there are not children?
+            first : Tree | Token | None = item
+            last : Tree | Token | None = item
+            while is_tree(first):
+                first = first.children[0] if first.children else None  # type: ignore[union-attr]
+            while is_tree(last):
+                last = last.children[-1] if last.children else None  # type: ignore[union-attr]
             # only continue if first and last tokens were found
             if first and last:
                 # get start- and endpoints of the error
@@ -118,6 +310,72 @@ class Fail(Exception):
         # default error message without line information
         super().__init__("Error during execution: " + str(msg))
 
+    def __reduce__(self):
+        # keep the whole message including the source location, e.g. when sent from a worker process
+        return restore_fail, (str(self),)
+
+
+def restore_fail(text : str) -> Fail:
+    '''recreate a Fail with the given message'''
+    fail = Fail.__new__(Fail)
+    Exception.__init__(fail, text)
+    return fail
+
+
+def is_tree(item : Any) -> bool:
+    '''check if the item is a node of a syntax tree, as opposed to a token, without depending on the tree classes of lark'''
+    return hasattr(item, 'children')
+
+
+
+##########
+########## parallel execution
+##########
+
+# program and worker count of the current pool, and the pool itself
+_pmap_pool : Optional[tuple[Any, Optional[int], Any]] = None
+# program of a worker process
+_worker_program : Any = None
+
+def pmap_setting(value : Optional[int], variable : str) -> Optional[int]:
+    '''return the setting if it is given, otherwise the positive integer in the environment variable, if it is set'''
+    if value is not None or not os.environ.get(variable):
+        return value
+    text = os.environ[variable]
+    if not text.isdigit() or int(text) < 1:
+        raise Fail(f'pmap: {variable} has to be a positive integer, got {text!r}')
+    return int(text)
+
+def get_pmap_pool(program : Any, workers : Optional[int]) -> Any:
+    '''return a pool of worker processes for the program, the program is only sent to each worker once'''
+    global _pmap_pool  # pylint: disable=global-statement
+    if _pmap_pool is not None and _pmap_pool[0] is program and _pmap_pool[1] == workers:
+        return _pmap_pool[2]
+    shutdown_pmap_pool()
+    # only imported when needed, as it is slow to import
+    import multiprocessing
+    pool = multiprocessing.Pool(workers, initializer=init_pmap_worker, initargs=(program, Fail.source))  # pylint: disable=consider-using-with
+    _pmap_pool = program, workers, pool
+    return pool
+
+@atexit.register
+def shutdown_pmap_pool() -> None:
+    '''stop the worker processes'''
+    global _pmap_pool  # pylint: disable=global-statement
+    if _pmap_pool is not None:
+        _pmap_pool[2].terminate()  # pylint: disable=unsubscriptable-object
+        _pmap_pool = None
+
+def init_pmap_worker(program : Any, source : list[str]) -> None:
+    '''initialize a worker process with the program'''
+    global _worker_program  # pylint: disable=global-statement
+    _worker_program = program
+    Fail.source = source
+
+def run_pmap_call(name : str, arg : Object) -> Object:
+    '''call a function of the program in a worker process'''
+    return _worker_program.call(name, arg)
+
 
 
 ##########
@@ -132,9 +390,36 @@ def asdf_print(*args : Value) -> Value:
     return args[0]  # return *first* argument
 
 def asdf_input() -> Value:
-    '''read and return user input'''
-    # ignore the newline symbol at the end
-    return Value(input_stream.readline()[:-1])
+    '''read and return user input, an empty string at the end of the input'''
+    line = get_input_buffer().readline()
+    return Value(line if line is not None else '')
+
+def asdf_readline() -> Value:
+    '''read and return the next line of the input, None at the end of the input'''
+    return Value(get_input_buffer().readline())
+
+def asdf_read(n : Value) -> Value:
+    '''read and return up to n characters of the input, an empty string at the end of the input'''
+    if not isinstance(n.value, int) or n.value < 1:
+        raise Fail(f'read: expected a positive number of characters, got {n.value}')
+    return Value(get_input_buffer().read(n.value))
+
+def asdf_eof() -> Value:
+    '''check if the whole input was read'''
+    return Value(get_input_buffer().at_eof())
+
+def asdf_lines() -> Lines:
+    '''iterate over the lines of the input'''
+    return Lines(get_input_buffer())
+
+def asdf_next(lines : Object) -> Value:
+    '''return the next line of a `lines()` iterator'''
+    if not isinstance(lines, Lines):
+        raise Fail(f'next: expected lines, got {lines}')
+    line = lines.buffer.readline()
+    if line is None:
+        raise Fail('next: no lines left')
+    return Value(line)
 
 def asdf_add(*args : Value) -> Value:
     '''operation: add'''
@@ -159,7 +444,8 @@ def asdf_mul(*args : Value) -> Value:
     if len(args) < 2:
         raise Fail(f'mul: need at least two arguments, got {len(args)}')
     try:
-        import math
+        if gmpy2 and all(isinstance(arg.value, int) for arg in args) and max(abs(arg.value) for arg in args).bit_length() > gmpy2_threshold:
+            return Value(int(math.prod(gmpy2.mpz(arg.value) for arg in args)))
         return Value(math.prod(arg.value for arg in args))
     except TypeError as err:
         raise Fail(err) from err
@@ -169,13 +455,127 @@ def asdf_div(*args : Value) -> Value:
     if len(args) < 2:
         raise Fail(f'div: need at least two arguments, got {len(args)}')
     try:
-        import math
         return Value(args[0].value / math.prod(arg.value for arg in args[1:]))
     except ZeroDivisionError as err:
         raise Fail('div: disors have to be greater than 0') from err
     except TypeError as err:
         raise Fail(err) from err
 
+def asdf_pow(base : Value, exponent : Value) -> Value:
+    '''operation: power'''
+    try:
+        if gmpy2 and isinstance(base.value, int) and isinstance(exponent.value, int) and exponent.value > 0 and base.value.bit_length() * exponent.value > gmpy2_threshold:
+            return Value(int(gmpy2.mpz(base.value) ** exponent.value))
+        return Value(base.value ** exponent.value)
+    except ZeroDivisionError as err:
+        raise Fail('pow: 0 cannot be raised to a negative power') from err
+    except TypeError as err:
+        raise Fail(err) from err
+
+def asdf_mod(a : Value, b : Value) -> Value:
+    '''operation: modulo'''
+    try:
+        return Value(a.value % b.value)
+    except ZeroDivisionError as err:
+        raise Fail('mod: modulus has to be non-zero') from err
+    except TypeError as err:
+        raise Fail(err) from err
+
+def asdf_powmod(base : Value, exponent : Value, modulus : Value) -> Value:
+    '''operation: modular power, `mod(pow(base, exponent), modulus)` without the big intermediate result'''
+    if not all(isinstance(x.value, int) for x in (base, exponent, modulus)):
+        raise Fail(f'powmod: expected integers, got {base.value}, {exponent.value}, {modulus.value}')
+    try:
+        if gmpy2:
+            return Value(int(gmpy2.powmod(base.value, exponent.value, modulus.value)))
+        return Value(pow(base.value, exponent.value, modulus.value))
+    except (ValueError, ZeroDivisionError) as err:
+        raise Fail(f'powmod: {err}') from err
+
+def asdf_divmod(a : Value, b : Value) -> Map:
+    '''operation: integer division and modulo, returns both as map `{0: quotient, 1: remainder}`'''
+    try:
+        quotient, remainder = divmod(a.value, b.value)
+        return Map({0: Value(quotient), 1: Value(remainder)})
+    except ZeroDivisionError as err:
+        raise Fail('divmod: divisor has to be non-zero') from err
+    except TypeError as err:
+        raise Fail(err) from err
+
+def map_key(key : Object, fname : str, item : Tree | None = None) -> Any:
+    '''convert an object into a key of a map, errors are shown at `item` if given'''
+    if not isinstance(key, Value):
+        raise Fail(f'{fname}: cannot use {key.print()} as key', item)  # type: ignore[attr-defined]
+    try:
+        hash(key.value)
+    except TypeError as err:
+        raise Fail(f'{fname}: cannot use {key.print()} as key, as it is not hashable', item) from err
+    return key.value
+
+def expect_map(m : Object, fname : str) -> Map:
+    '''check that the first argument is a map'''
+    if not isinstance(m, Map):
+        raise Fail(f'{fname}: expected a map, got {m}')
+    return m
+
+def asdf_map(*args : Object) -> Map:
+    '''create a map from the given keys and values: `map(key1, value1, key2, value2, ...)`'''
+    if len(args) % 2:
+        raise Fail(f'map: need pairs of keys and values, got {len(args)} arguments')
+    return Map({map_key(key, 'map'): share(value) for key, value in zip(args[::2], args[1::2])})
+
+def asdf_get(m : Object, key : Object, *default : Object) -> Object:
+    '''get the value of `key` in the map, or `default` if given and `key` is missing, maps and builders are returned as copies'''
+    table = expect_map(m, 'get').value
+    k = map_key(key, 'get')
+    if k in table:
+        # maps and builders are returned as copies, as the table may be shared with other maps
+        return share(table[k])
+    if len(default) == 1:
+        return default[0]
+    if default:
+        raise Fail(f'get: need two or three arguments, got {2 + len(default)}')
+    raise Fail(f'get: key {key.print()} not found')  # type: ignore[attr-defined]
+
+def asdf_put(m : Object, key : Object, value : Object) -> Map:
+    '''set `key` to `value` in the map and return the map, maps and builders are stored as copies'''
+    value = share(value)  # before `writable`, so that a map stored in itself is a copy of the previous content
+    expect_map(m, 'put').writable()[map_key(key, 'put')] = value
+    return m  # type: ignore[return-value]
+
+def asdf_has(m : Object, key : Object) -> Value:
+    '''check if `key` is in the map'''
+    return Value(map_key(key, 'has') in expect_map(m, 'has').value)
+
+def asdf_keys(m : Object) -> Map:
+    '''return the keys of the map, as map from their index to them'''
+    return Map({i: Value(key) for i, key in enumerate(expect_map(m, 'keys').value)})
+
+def asdf_size(m : Object) -> Value:
+    '''return the number of entries of the map'''
+    return Value(len(expect_map(m, 'size').value))
+
+def asdf_pmap(func : Object, *args : Object) -> Map:
+    '''
+    call a defined function for each argument in parallel worker processes, return the results as map from the index to the result.
+    If a single map is given, the function is called for each of its values and the results are returned under the same keys.
+    '''
+    program = getattr(func, 'program', None)
+    if not isinstance(func, Function) or program is None:
+        raise Fail(f'pmap: expected a defined function, got {func}')
+    workers = pmap_setting(pmap_workers, 'ASDF_PMAP_WORKERS')
+    chunksize = pmap_setting(pmap_chunksize, 'ASDF_PMAP_CHUNKSIZE')
+    keys : Any = range(len(args))
+    if len(args) == 1 and isinstance(args[0], Map):
+        keys, args = args[0].value.keys(), tuple(args[0].value.values())
+    try:
+        results = get_pmap_pool(program, workers).map(partial(run_pmap_call, func.name), args, chunksize)
+    except Fail:
+        raise
+    except Exception as err:
+        raise Fail(f'pmap: {err}') from err
+    return Map(dict(zip(keys, results)))
+
 def asdf_length(x : Value) -> Value:
     '''determine length'''
     if hasattr(x.value, '__len__'):
@@ -183,6 +583,61 @@ def asdf_length(x : Value) -> Value:
     else:
         raise Fail(f'cannot determine length of {x}')
 
+def is_int(value : Any) -> bool:
+    '''check if the value is an integer, but not a boolean'''
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def expect_string(s : Object, fname : str) -> str:
+    '''check that the argument is a string or builder and return the string'''
+    if not isinstance(s, Value) or not isinstance(s.value, str):
+        raise Fail(f'{fname}: expected a string, got {s}')
+    return s.value
+
+def string_args(args : tuple[Object, ...], fname : str) -> list[str]:
+    '''return the strings of the arguments, or of the values of a single map argument'''
+    if len(args) == 1 and isinstance(args[0], Map):
+        args = tuple(args[0].value.values())
+    return [expect_string(arg, fname) for arg in args]
+
+def asdf_concat(*args : Object) -> Value:
+    '''concatenate the given strings'''
+    return Value(''.join(expect_string(arg, 'concat') for arg in args))
+
+def asdf_join(separator : Object, *args : Object) -> Value:
+    '''join the given strings, or the values of a single map, with the separator in between'''
+    return Value(expect_string(separator, 'join').join(string_args(args, 'join')))
+
+def asdf_substr(s : Object, start : Value, *end : Value) -> Value:
+    '''return the part of the string from `start` up to `end` (exclusive, optional), negative positions count from the end'''
+    text = expect_string(s, 'substr')
+    if len(end) > 1:
+        raise Fail(f'substr: need two or three arguments, got {2 + len(end)}')
+    stop = end[0].value if end else None
+    if not is_int(start.value) or not (stop is None or is_int(stop)):
+        raise Fail(f'substr: expected integer positions, got {start.value}{f", {stop}" if end else ""}')
+    return Value(text[start.value:stop])
+
+def asdf_split(s : Object, *separator : Object) -> Map:
+    '''split the string at the separator, or at whitespace if none is given, return the parts as map from their index to them'''
+    if len(separator) > 1:
+        raise Fail(f'split: need one or two arguments, got {1 + len(separator)}')
+    text = expect_string(s, 'split')
+    sep = expect_string(separator[0], 'split') if separator else None
+    if sep == '':
+        raise Fail('split: separator must not be empty')
+    return Map({i: Value(part) for i, part in enumerate(text.split(sep))})
+
+def asdf_builder(*args : Object) -> Builder:
+    '''create a string builder, optionally starting with the given strings'''
+    return Builder(string_args(args, 'builder'))
+
+def asdf_append(b : Object, *args : Object) -> Builder:
+    '''append the given strings to the builder and return the builder'''
+    if not isinstance(b, Builder):
+        raise Fail(f'append: expected a builder, got {b}')
+    b.writable().extend(string_args(args, 'append'))
+    return b
+
 def asdf_eq(a : Value, b : Value) -> Value:
     '''comparison: equal'''
     try:
@@ -223,11 +678,33 @@ def asdf_geq(a : Value, b : Value) -> Value:
 std_names : dict[str, Object] = {
     'print': StdFunction('print', asdf_print),
     'input': StdFunction('input', asdf_input),
+    'readline': StdFunction('readline', asdf_readline),
+    'read': StdFunction('read', asdf_read),
+    'eof': StdFunction('eof', asdf_eof),
+    'lines': StdFunction('lines', asdf_lines),
+    'next': StdFunction('next', asdf_next),
     'add': StdFunction('add', asdf_add),
     'sub': StdFunction('sub', asdf_sub),
     'mul': StdFunction('mul', asdf_mul),
     'div': StdFunction('div', asdf_div),
+    'pow': StdFunction('pow', asdf_pow),
+    'mod': StdFunction('mod', asdf_mod),
+    'powmod': StdFunction('powmod', asdf_powmod),
+    'divmod': StdFunction('divmod', asdf_divmod),
     'length': StdFunction('length', asdf_length),
+    'map': StdFunction('map', asdf_map),
+    'get': StdFunction('get', asdf_get),
+    'put': StdFunction('put', asdf_put),
+    'has': StdFunction('has', asdf_has),
+    'keys': StdFunction('keys', asdf_keys),
+    'size': StdFunction('size', asdf_size),
+    'pmap': StdFunction('pmap', asdf_pmap),
+    'concat': StdFunction('concat', asdf_concat),
+    'join': StdFunction('join', asdf_join),
+    'substr': StdFunction('substr', asdf_substr),
+    'split': StdFunction('split', asdf_split),
+    'builder': StdFunction('builder', asdf_builder),
+    'append': StdFunction('append', asdf_append),
     'eq': StdFunction('eq', asdf_eq),
     'lt': StdFunction('lt', asdf_lt),
     'leq': StdFunction('leq', asdf_leq),
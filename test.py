@@ -7,12 +7,20 @@ author: Jonas Loos (2023)
 # pylint: disable=missing-function-docstring
 
 import unittest
+from unittest import mock
+import os
 import io
+import glob
+import json
+import tempfile
 import subprocess
 import textwrap
 from parsing import parse, ParserError
-from interpreter import interpret
-from stdlib import Fail
+from interpreter import interpret, compile, Interpreter  # pylint: disable=redefined-builtin
+import stdlib
+from stdlib import Fail, Value, Function
+from artifact import HEADER
+from tracing import TraceWriter, Coverage
 
 
 
@@ -26,12 +34,12 @@ class TestMain(unittest.TestCase):
     def test_no_args(self):
         result = subprocess.run(['python', 'main.py'], capture_output=True, check=False)
         self.assertNotEqual(result.returncode, 0)
-        self.assertEqual(result.stderr.strip(), b'USAGE: python main.py FILE')
+        self.assertEqual(result.stderr.strip(), b'USAGE: python main.py [--compile-to FILE.asdfc] FILE')
 
     def test_many_args(self):
         result = subprocess.run(['python', 'main.py', 'asdf', 'asdf'], capture_output=True, check=False)
         self.assertNotEqual(result.returncode, 0)
-        self.assertEqual(result.stderr.strip(), b'USAGE: python main.py FILE')
+        self.assertEqual(result.stderr.strip(), b'USAGE: python main.py [--compile-to FILE.asdfc] FILE')
 
     def test_non_existing_file(self):
         result = run_file('asdfasdfasdf')
@@ -43,6 +51,29 @@ class TestMain(unittest.TestCase):
         self.assertNotEqual(result.returncode, 0)
         self.assertEqual(result.stderr.decode()[:5], 'Error')
 
+    def test_compile_to(self):
+        with tempfile.TemporaryDirectory() as directory:
+            artifact = f'{directory}/greet.asdfc'
+            result = subprocess.run(['python', 'main.py', '--compile-to', artifact, 'examples/greet.asdf'], capture_output=True, check=False)
+            self.assertEqual(result.returncode, 0)
+            # the artifact runs with the same output, without importing lark
+            result = subprocess.run(['python', '-X', 'importtime', 'runner.py', artifact], input=b'World\n', capture_output=True, check=False)
+            self.assertEqual(result.returncode, 0)
+            self.assertEqual(result.stdout.strip()[-13:], b'Hello, World!')
+            self.assertNotIn(b'lark', result.stderr)
+
+    def test_stale_artifact(self):
+        with tempfile.TemporaryDirectory() as directory:
+            artifact = f'{directory}/counter.asdfc'
+            subprocess.run(['python', 'main.py', '--compile-to', artifact, 'examples/counter.asdf'], capture_output=True, check=True)
+            with open(artifact, 'rb') as file:
+                data = file.read()
+            with open(artifact, 'wb') as file:
+                file.write(HEADER.replace(b' 1 ', b' 0 ') + data[len(HEADER):])
+            result = subprocess.run(['python', 'runner.py', artifact], capture_output=True, check=False)
+            self.assertNotEqual(result.returncode, 0)
+            self.assertIn(b'compile it again', result.stderr)
+
 
 class TestParser(unittest.TestCase):
     '''unit-tests for parser.py'''
@@ -67,8 +98,8 @@ class TestParser(unittest.TestCase):
             self.fail(f"test failed: unexpected ParserError: {err}")
 
 
-class TestInterpreter(unittest.TestCase):
-    '''unit-tests for interpreter.py'''
+class InterpreterTestCase(unittest.TestCase):
+    '''base class with assertions for running programs'''
 
     def assertOutputEqual(self, program : str, test : str):
         '''test if the output when running the `program` is equal to `test`'''
@@ -89,6 +120,16 @@ class TestInterpreter(unittest.TestCase):
             if msg:
                 self.assertIn(msg, str(err))
 
+    def assertOutputWithInput(self, program : str, input_text : str, test : str):
+        '''test if the output when running the `program` with the given input is equal to `test`'''
+        with io.StringIO(input_text) as input_stream, io.StringIO() as result:
+            interpret(parse(textwrap.dedent(program)), input_stream, result)
+            self.assertEqual(result.getvalue(), test)
+
+
+class TestInterpreter(InterpreterTestCase):  # pylint: disable=too-many-public-methods
+    '''unit-tests for interpreter.py'''
+
     def test_print42(self):
         self.assertOutputEqual('''\
             def main()
@@ -117,6 +158,91 @@ class TestInterpreter(unittest.TestCase):
                 x = 42
                 print("the answer is {x}")
         ''', 'the answer is 42\n')
+        self.assertOutputEqual('''\
+            def main()
+                m = {'a': 2}
+                b = builder('x', 'y')
+                w = 6
+                c = '*'
+                print("{m} {m[a]} {b} {b:>4} {{x}} [{b:>{w}}] [{m[a]:{c}^{w}}]")
+        ''', "{'a': 2} 2 xy   xy {x} [    xy] [**2***]\n")
+        self.assertFail('''\
+            def main()
+                print("{print}")
+        ''', "Could not find variable 'print' used in format string")
+
+    def test_number_literals(self):
+        self.assertOutputEqual('''\
+            def main()
+                print(0x1F, 0o17, 0b101, 1_000)
+                print(1.5, 2e3, .5)
+                print(3i, 1.5j)
+        ''', '31 15 5 1000\n1.5 2000.0 0.5\n3j 1.5j\n')
+
+    def test_invalid_number_literal(self):
+        self.assertFail('''\
+            def main()
+                print(0x)
+        ''', 'invalid number `0x`')
+
+    def test_multiline_map_literal(self):
+        self.assertOutputEqual('''\
+            def main()
+                m = {
+                    'a': 1,  # comment
+                    'b': add(1, 1),
+                }
+                print(get(m, 'b'))
+        ''', '2\n')
+
+    def test_map_unhashable_key(self):
+        self.assertFail('''\
+            def main()
+                {{}: 1}
+        ''', 'not hashable')
+        self.assertFail('''\
+            def main()
+                {print: 1}
+        ''', 'map literal: cannot use')
+
+    dispatch_program = '''\
+        def main()
+            print(f('a'), f('b'), f(1), f(1.0), f(true), f(2), f('x'), f({}))
+        def f(x)
+            if eq(x, 'a')
+                'A'
+            elif eq(x, "b")
+                'B'
+            elif eq(x, 1)
+                'one'
+            elif eq(x, 'a')
+                'unreachable'
+            elif eq(x, 0x2)
+                'two'
+            else
+                'other'
+    '''
+
+    def test_if_dispatch(self):
+        output = 'A B one one one two other other\n'
+        self.assertOutputEqual(self.dispatch_program, output)
+        with io.StringIO() as result:
+            interpreter = Interpreter()
+            interpret(parse(textwrap.dedent(self.dispatch_program)), output_stream=result, interpreter=interpreter)
+            self.assertEqual(result.getvalue(), output)
+        # `eq` is only called for `f({})`, as maps aren't hashable and can't be dispatched
+        self.assertEqual(interpreter.cache_stats()['eq'], (0, 5))
+
+    def test_if_dispatch_fallback(self):
+        self.assertOutputEqual('''\
+            def main()
+                print(f('a', eq), f('a', lt))
+            def f(x, eq)
+                if eq(x, 'a')
+                    'A'
+                elif eq(x, 'b')
+                    'B'
+        ''', 'A B\n')
 
     def test_missing_function_def(self):
         self.assertFail('''\
@@ -133,6 +259,486 @@ class TestInterpreter(unittest.TestCase):
                 print(x)
         ''', '10\n')
 
+    def test_do(self):
+        self.assertOutputEqual('''\
+            def main()
+                do
+                    x = 1
+                    print(x)
+                print(add(x, _))
+        ''', '1\n2\n')
+
+    def test_compile_once(self):
+        program = compile(parse(textwrap.dedent('''\
+            def main()
+                i = 0
+                while lt(i, 3)
+                    do
+                        print("{i}:", input())
+                    i = add(i, 1)
+        ''')))
+        call_sites = len(program.interpreter.call_sites)
+        for name in ('a', 'b'):
+            with io.StringIO(f'{name}1\n{name}2\n{name}3\n') as input_stream, io.StringIO() as result:
+                program(input_stream, result)
+                self.assertEqual(result.getvalue(), f'0: {name}1\n1: {name}2\n2: {name}3\n')
+        # nothing was compiled while running
+        self.assertEqual(len(program.interpreter.call_sites), call_sites)
+
+    def test_compile_twice(self):
+        interpreter = Interpreter()
+        with io.StringIO() as result:
+            interpret(parse(textwrap.dedent('''\
+                def main()
+                    helper()
+                def helper()
+                    print('from program 1')
+            ''')), output_stream=result, interpreter=interpreter)
+            self.assertEqual(result.getvalue(), 'from program 1\n')
+        with self.assertRaisesRegex(Fail, 'call of undefined function: helper'):
+            compile(parse('def main()\n    helper()\n'), interpreter)()
+
+    def test_inlining(self):
+        interpreter = Interpreter()
+        with io.StringIO() as result:
+            interpret(parse(textwrap.dedent('''\
+                def main()
+                    x = {'a': 1}
+                    print(small(x, 2), _, x)
+                    print(fact(3))
+                def small(m, y)
+                    put(m, 'a', y)
+                    print(_, m, y)
+                    m
+                def fact(n)
+                    if lt(n, 2)
+                        1
+                    else
+                        mul(fact(sub(n, 1)), n)
+            ''')), output_stream=result, interpreter=interpreter)
+            self.assertEqual(result.getvalue(), "{'a': 2} {'a': 2} 2\n{'a': 2} {'a': 1} {'a': 1}\n6\n")
+        stats = interpreter.cache_stats()
+        # `small` is inlined, `fact` is recursive
+        self.assertNotIn('small', stats)
+        self.assertIn('fact', stats)
+        self.assertFail('''\
+            def main()
+                small(1)
+            def small(x, y)
+                x
+        ''', 'wrong number of arguments when calling small: expected 2, got 1')
+
+    def test_inlining_scope(self):
+        interpreter = Interpreter()
+        with io.StringIO() as result:
+            interpret(parse(textwrap.dedent('''\
+                def main()
+                    x = 1
+                    print(inc(x), show(), twice(x), "{x}")
+                def inc(y)
+                    add(y, one())
+                def one()
+                    1
+                def show()
+                    "x is {x}"
+                def twice(y)
+                    concat(show(), "/{y}")
+            ''')), output_stream=result, interpreter=interpreter)
+            self.assertEqual(result.getvalue(), '2 x is 1 x is 1/1 1\n')
+        # `inc` only uses its argument and global names, `show` and `twice` use `x` of the caller
+        self.assertEqual(set(interpreter.functions['inc'].scope), {'add', 'one'})
+        self.assertIsNone(interpreter.functions['show'].scope)
+        self.assertIsNone(interpreter.functions['twice'].scope)
+
+    def test_inlining_equivalence(self):
+        inputs = {'examples/fox.asdf': ['asdf\n', 'fail\n', '\n'], 'examples/greet.asdf': ['World\n', 'x' * 50]}
+        for filename in sorted(glob.glob('examples/*.asdf')):
+            with open(filename, encoding='utf-8') as source_file:
+                program = parse(source_file.read())
+            for input_text in inputs.get(filename, ['line 1\nline 2\n']):
+                outputs = []
+                for threshold in (0, 32, 1000):
+                    with io.StringIO(input_text) as input_stream, io.StringIO() as result:
+                        try:
+                            interpret(program, input_stream, result, Interpreter(inline_threshold=threshold))
+                        except Fail as err:
+                            result.write(str(err))
+                        outputs.append(result.getvalue())
+                self.assertEqual(outputs[0], outputs[1], filename)
+                self.assertEqual(outputs[0], outputs[2], filename)
+
+    def test_counting_loop(self):
+        # too many iterations for the general path
+        self.assertOutputEqual('''\
+            def main()
+                i = 0
+                n = 1000000000
+                while lt(i, n)
+                    i = add(i, 1)
+                print(i, _)
+        ''', '1000000000 1000000000\n')
+
+    def test_counting_loop_equivalence(self):
+        loops = [
+            ('i = 0', 'lt(i, 10)', ['x = i', 'i = add(i, 3)', 'print(x, i, _)']),
+            ('i = 0', 'leq(i, 9)', ['i = add(i, 3)']),
+            ('i = 10', 'gt(i, 0)', ['print(i)', 'i = sub(i, 2)']),
+            ('i = 10', 'geq(i, 0)', ['i = sub(i, 2)', 'print(i)', 'if eq(i, 4)\n            "four {i}"']),
+            ('i = 5', 'lt(i, 5)', ['i = add(i, 1)']),
+            ('i = 0.5', 'lt(i, 3)', ['i = add(i, 1)']),
+            ('i = 0', 'lt(i, 10)', ['i = add(i, 1)', 'i = add(i, 1)']),
+            ('i = 0', 'lt(i, n)', ['n = sub(n, 1)', 'i = add(i, 1)']),
+            ('i = 0', 'lt(i, 10)', ['i = add(i, 1)', 'print(_, i)']),
+            # user-defined comparison and increment functions replace the builtins
+            ('i = 0', 'lt(i, 5)', ['i = add(i, 1)'], 'def lt(a, b)\n    false\n'),
+            ('i = 0', 'lt(i, 5)', ['print(i)', 'i = add(i, 1)'], 'def add(a, b)\n    sub(a, sub(0, b), sub(0, 1))\n'),
+        ]
+        for init, condition, body, *defs in loops:
+            program = parse(f'def main()\n    n = 10\n    {init}\n    while {condition}\n' + ''.join(f'        {stmt}\n' for stmt in body) + '    print(i, _)\n' + ''.join(defs))
+            outputs = []
+            for optimize in (False, True):
+                with io.StringIO() as result:
+                    interpret(program, output_stream=result, interpreter=Interpreter(optimize=optimize))
+                    outputs.append(result.getvalue())
+            self.assertEqual(outputs[0], outputs[1], (init, condition, body))
+
+    def test_call_cache(self):
+        interpreter = Interpreter(inline_threshold=0)
+        with io.StringIO() as result:
+            interpret(parse(textwrap.dedent('''\
+                def main()
+                    x = 0
+                    while lt(x, 10)
+                        x = f(x)
+                    print(x)
+                def f(x)
+                    add(x, 1)
+            ''')), output_stream=result, interpreter=interpreter)
+            self.assertEqual(result.getvalue(), '10\n')
+        stats = interpreter.cache_stats()
+        self.assertEqual(stats['f'], (9, 1))
+        self.assertEqual(stats['add'], (9, 1))
+        self.assertEqual(stats['lt'], (10, 1))
+
+    def test_call_cache_shadowed(self):
+        self.assertOutputEqual('''\
+            def main()
+                g = f
+                print(call(f))
+                print(call(g))
+                print(call(h))
+            def call(f)
+                f()
+            def f()
+                'f'
+            def h()
+                'h'
+        ''', 'f\nf\nh\n')
+
+
+class TestStdlib(InterpreterTestCase):
+    '''unit-tests for stdlib.py'''
+
+    def test_integer_arithmetic(self):
+        self.assertOutputEqual('''\
+            def main()
+                print(pow(2, 100))
+                print(mod(17, 5), mod(sub(0, 17), 5))
+                print(powmod(3, 200, 1000), powmod(7, 123456789, 1000000007))
+                print(divmod(17, 5), get(divmod(17, 5), 1))
+        ''', f'{2**100}\n2 3\n1 {pow(7, 123456789, 1000000007)}\n{{0: 3, 1: 2}} 2\n')
+
+    def test_big_integer_output(self):
+        self.assertOutputEqual('''\
+            def main()
+                print(pow(10, 5000))
+        ''', '1' + '0' * 5000 + '\n')
+
+    def test_mod_by_zero(self):
+        self.assertFail('''\
+            def main()
+                mod(1, 0)
+        ''', 'modulus has to be non-zero')
+
+    def test_map(self):
+        self.assertOutputEqual('''\
+            def main()
+                m = {'a': 1, 2: 'b'}
+                print(get(m, 'a'), get(m, 2), get(m, 'x', 0))
+                print(has(m, 'a'), has(m, 'x'), size(m))
+                put(m, 'c', 3)
+                print(m, keys(m))
+                print(map('k', 'v'), {})
+        ''', "1 b 0\nTrue False 2\n{'a': 1, 2: 'b', 'c': 3} {0: 'a', 1: 2, 2: 'c'}\n{'k': 'v'} {}\n")
+
+    def test_map_copy_on_write(self):
+        self.assertOutputEqual('''\
+            def main()
+                m = {'a': 1}
+                print(f(m))
+                print(m)
+                print(g(m))
+            def f(x)
+                put(x, 'a', 2)
+            def g(x)
+                get(x, 'a')
+        ''', "{'a': 2}\n{'a': 1}\n1\n")
+
+    def test_map_nested_by_value(self):
+        self.assertOutputEqual('''\
+            def main()
+                m = {'in': {'x': 1}}
+                f(m)
+                print(m)
+                put(get(m, 'in'), 'x', 2)
+                print(m)
+                put(m, 'in', put(get(m, 'in'), 'x', 3))
+                print(m)
+                other = {}
+                put(other, 'in', get(m, 'in'))
+                put(other, 'in', put(get(other, 'in'), 'x', 4))
+                print(m, other)
+                copy = same(m)
+                put(copy, 'in', put(get(copy, 'in'), 'x', 5))
+                print(m, copy)
+                x = get(m, 'in')
+                snapshot = {'old': m}
+                c = same(m)
+                put(x, 'x', 6)
+                print(m, snapshot, c)
+                n = {'b': builder('a')}
+                b = get(n, 'b')
+                snapshot = {'old': n}
+                append(b, 'b')
+                print(n, snapshot, b)
+            def f(x)
+                put(x, 'in', put(get(x, 'in'), 'x', 99))
+            def same(x)
+                x
+        ''', "{'in': {'x': 1}}\n{'in': {'x': 1}}\n{'in': {'x': 3}}\n{'in': {'x': 3}} {'in': {'x': 4}}\n{'in': {'x': 3}} {'in': {'x': 5}}\n{'in': {'x': 3}} {'old': {'in': {'x': 3}}} {'in': {'x': 3}}\n{'b': 'a'} {'old': {'b': 'a'}} ab\n")
+
+    def test_map_shares_released(self):
+        program = compile(parse(textwrap.dedent('''\
+            def main()
+                0
+            def peek(m, b)
+                get(get(m, 'in'), 'x')
+                append(b, 'y')
+        ''')))
+        m = program.call('map', Value('in'), program.call('map', Value('x'), Value(1)))
+        b = program.call('builder', Value('x'))
+        for _ in range(3):
+            program.call('peek', m, b)
+        # the arguments aren't shared anymore after the calls, so modifying them doesn't copy them
+        self.assertEqual((m.refs, b.refs), ([1], [1]))
+        self.assertEqual(b.value, 'x')
+
+    def test_map_missing_key(self):
+        self.assertFail('''\
+            def main()
+                get({}, 'a')
+        ''', 'key a not found')
+
+    def test_pmap(self):
+        self.assertOutputEqual('''\
+            def main()
+                print(pmap(square, 1, 2, 3))
+                print(pmap(square, {'a': 4, 'b': 5}))
+                print(pmap(square))
+            def square(x)
+                mul(x, helper(x))
+            def helper(y)
+                _
+        ''', "{0: 1, 1: 4, 2: 9}\n{'a': 16, 'b': 25}\n{}\n")
+
+    def test_pmap_fail(self):
+        self.assertFail('''\
+            def main()
+                pmap(f, 1, 0)
+            def f(x)
+                div(1, x)
+        ''', 'disors have to be greater than 0')
+        self.assertFail('''\
+            def main()
+                pmap(f, 1, 0)
+            def f(x)
+                if eq(x, 0)
+                    undefined_name
+        ''', 'Use of undefined name `undefined_name`, at line 5')
+        self.assertFail('''\
+            def main()
+                pmap(add, 1, 2)
+        ''', 'pmap: expected a defined function')
+
+    def test_pmap_settings(self):
+        program = '''\
+            def main()
+                print(pmap(f, 5, 4, 3, 2, 1, 0))
+            def f(x)
+                if eq(x, 0)
+                    undefined_name
+                sub(10, x)
+        '''
+        try:
+            # every call is sent to a worker on its own, the results are still in the order of the arguments
+            stdlib.pmap_workers, stdlib.pmap_chunksize = 2, 1
+            self.assertOutputEqual(program.replace('1, 0', '1'), '{0: 5, 1: 6, 2: 7, 3: 8, 4: 9}\n')
+            self.assertFail(program, 'Use of undefined name `undefined_name`, at line 5')
+        finally:
+            stdlib.pmap_workers = stdlib.pmap_chunksize = None
+            stdlib.shutdown_pmap_pool()
+        with mock.patch.dict(os.environ, {'ASDF_PMAP_WORKERS': '2', 'ASDF_PMAP_CHUNKSIZE': '1'}):
+            self.assertOutputEqual(program.replace('1, 0', '1'), '{0: 5, 1: 6, 2: 7, 3: 8, 4: 9}\n')
+        with mock.patch.dict(os.environ, {'ASDF_PMAP_WORKERS': 'many'}):
+            self.assertFail(program, "pmap: ASDF_PMAP_WORKERS has to be a positive integer, got 'many'")
+        stdlib.shutdown_pmap_pool()
+
+    def test_string_functions(self):
+        self.assertOutputEqual('''\
+            def main()
+                print(concat('ab', 'cd', ''), join(', ', 'a', 'b'), join('-', split('x y  z')))
+                print(substr('hello', 1, 3), substr('hello', sub(0, 2)), split('a,b,,c', ','))
+        ''', "abcd a, b x-y-z\nel lo {0: 'a', 1: 'b', 2: '', 3: 'c'}\n")
+
+    def test_string_functions_fail(self):
+        self.assertFail('''\
+            def main()
+                concat('a', 1)
+        ''', 'concat: expected a string')
+        self.assertFail('''\
+            def main()
+                substr('abc', 'b')
+        ''', 'substr: expected integer positions')
+        self.assertFail('''\
+            def main()
+                split('abc', '')
+        ''', 'split: separator must not be empty')
+
+    def test_builder(self):
+        self.assertOutputEqual('''\
+            def main()
+                b = builder()
+                i = 0
+                while lt(i, 3)
+                    append(b, "{i}", ',')
+                    i = add(i, 1)
+                print(b, length(b))
+                append(b, 'x')
+                print(b, eq(b, '0,1,2,x'), concat(b, '!'))
+        ''', '0,1,2, 6\n0,1,2,x True 0,1,2,x!\n')
+
+    def test_builder_copy_on_write(self):
+        self.assertOutputEqual('''\
+            def main()
+                b = builder('a')
+                print(f(b))
+                print(b)
+            def f(x)
+                append(x, 'b')
+        ''', 'ab\na\n')
+        self.assertFail('''\
+            def main()
+                append('a', 'b')
+        ''', 'append: expected a builder')
+
+    def test_readline(self):
+        self.assertOutputWithInput('''\
+            def main()
+                print(readline())
+                print(readline())
+                print(eof())
+                print(readline())
+                print(input())
+        ''', 'a\nb', 'a\nb\nTrue\nNone\n\n')
+
+    def test_lines(self):
+        self.assertOutputWithInput('''\
+            def main()
+                input_lines = lines()
+                while input_lines
+                    print(length(next(input_lines)))
+        ''', 'abc\n\nde\n', '3\n0\n2\n')
+
+    def test_read_chunks(self):
+        self.assertOutputWithInput('''\
+            def main()
+                print(read(3))
+                print(input())
+                print(read(3))
+                print(read(3))
+                print(length(read(3)))
+        ''', 'abcdef\nghij', 'abc\ndef\nghi\nj\n0\n')
+
+    def test_next_at_eof(self):
+        with io.StringIO('') as input_stream:
+            with self.assertRaises(Fail):
+                interpret(parse(textwrap.dedent('''\
+                    def main()
+                        next(lines())
+                ''')), input_stream)
+
+
+class TestTracing(unittest.TestCase):
+    '''unit-tests for tracing.py'''
+
+    program = textwrap.dedent('''\
+        def main()
+            x = f(1)
+            if false
+                print(x)
+        def f(x)
+            add(x, 1)
+    ''')
+
+    def test_trace(self):
+        with io.StringIO() as trace:
+            interpret(parse(self.program), interpreter=Interpreter(TraceWriter(trace)))
+            events = [json.loads(line) for line in trace.getvalue().splitlines()]
+        self.assertEqual([(e['event'], e['line']) for e in events], [
+            ('enter', 1), ('statement', 2), ('enter', 5), ('statement', 6), ('builtin', 6),
+            ('exit', 5), ('assignment', 2), ('statement', 3), ('exit', 1)])
+        self.assertEqual(events[4]['args'], [1, 1])
+        self.assertEqual(events[6]['value'], 2)
+
+    def test_coverage(self):
+        coverage = Coverage()
+        program = parse(self.program)
+        interpret(program, interpreter=Interpreter(coverage))
+        report = coverage.report(program, self.program)
+        self.assertEqual([line[0] for line in report.splitlines()[:6]], ['>', '>', '>', '!', '>', '>'])
+        self.assertIn('covered 5 of 6 lines', report)
+
+    def test_trace_error(self):
+        with io.StringIO() as trace:
+            with self.assertRaises(Fail):
+                interpret(parse('def main()\n    f(0)\ndef f(x)\n    div(1, x)\n'), interpreter=Interpreter(TraceWriter(trace)))
+            events = [json.loads(line) for line in trace.getvalue().splitlines()]
+        # every function which was entered is left with an exit or error event
+        self.assertEqual([(e['event'], e['line']) for e in events], [
+            ('enter', 1), ('statement', 2), ('enter', 3), ('statement', 4), ('error', 3), ('error', 1)])
+
+    def test_no_hooks(self):
+        def closures(obj, seen):
+            '''qualified names of all functions reachable from the closure cells of `obj`'''
+            if id(obj) in seen:
+                return set()
+            seen.add(id(obj))
+            if isinstance(obj, Function):
+                return closures(obj.fun, seen)
+            if isinstance(obj, (list, tuple)):
+                return set().union(*(closures(x, seen) for x in obj))
+            if not callable(obj) or not hasattr(obj, '__closure__'):
+                return set()
+            cells = obj.__closure__ or ()
+            return {obj.__qualname__}.union(*(closures(cell.cell_contents, seen) for cell in cells))
+        traced = compile(parse(self.program), Interpreter(Coverage()))
+        self.assertTrue(any('run_traced_' in name for name in closures(traced.main, set())))
+        # without hooks, no tracing code is compiled in
+        program = compile(parse(self.program))
+        names = closures(program.main, set())
+        self.assertIn('run_statements.<locals>.run_body', names)
+        self.assertFalse([name for name in names if 'run_traced_' in name])
+
 
 class TestExamles(unittest.TestCase):
     '''unit-tests for examples'''
@@ -157,5 +763,24 @@ class TestExamles(unittest.TestCase):
         self.assertEqual(result.returncode, 0)
         self.assertEqual(result.stdout.strip()[-13:], b'Hello, World!')
 
+    def test_greet_open_pipe(self):
+        # the answer has to come without waiting for the end of the input
+        with subprocess.Popen(['python', 'main.py', 'examples/greet.asdf'], stdin=subprocess.PIPE, stdout=subprocess.PIPE) as process:
+            assert process.stdin and process.stdout
+            process.stdin.write(b'World\n')
+            process.stdin.flush()
+            try:
+                self.assertEqual(process.wait(timeout=10), 0)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                self.fail('test failed: the program waited for more input')
+            self.assertEqual(process.stdout.read().strip()[-13:], b'Hello, World!')
+            process.stdin.close()
+
+    def test_linecount(self):
+        result = run_file('examples/linecount.asdf', b'first\nsecond\n\nlast')
+        self.assertEqual(result.returncode, 0)
+        self.assertEqual(result.stdout.strip(), b'4 lines, 15 characters')
+
 if __name__ == '__main__':
     unittest.main()
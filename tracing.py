@@ -0,0 +1,122 @@
+'''
+observe the execution of a program without changing it.
+Provides two consumers of the `Hooks` of the interpreter: a JSON-lines
+trace writer and a line coverage reporter.
+
+usage:
+
+```
+python tracing.py trace FILE 2> trace.jsonl
+python tracing.py coverage FILE
+```
+
+author: Jonas Loos (2023)
+'''
+
+import sys
+import json
+from typing import TextIO
+from lark import Tree
+from parsing import ParserError, parse
+from stdlib import Object, Fail as InterpreterError
+from interpreter import Hooks, Interpreter, Position, interpret, source_position
+from main import fail
+
+
+
+class TraceWriter(Hooks):
+    '''write every event as a JSON object on its own line'''
+
+    def __init__(self, stream : TextIO):
+        self.stream = stream
+
+    def write(self, event : str, pos : Position, **data):
+        '''write a single event'''
+        line, column = pos
+        print(json.dumps({'event': event, 'line': line, 'column': column, **data}, default=str), file=self.stream)
+
+    def function_enter(self, name : str, args : tuple[Object, ...], position : Position) -> None:
+        self.write('enter', position, name=name, args=[printable(x) for x in args])
+
+    def function_exit(self, name : str, result : Object, position : Position) -> None:
+        self.write('exit', position, name=name, result=printable(result))
+
+    def function_error(self, name : str, error : BaseException, position : Position) -> None:
+        self.write('error', position, name=name, error=str(error))
+
+    def statement(self, position : Position) -> None:
+        self.write('statement', position)
+
+    def assignment(self, name : str, value : Object, position : Position) -> None:
+        self.write('assignment', position, name=name, value=printable(value))
+
+    def builtin_call(self, name : str, args : list[Object], result : Object, position : Position) -> None:
+        self.write('builtin', position, name=name, args=[printable(x) for x in args], result=printable(result))
+
+
+class Coverage(Hooks):
+    '''record which lines of the source code were executed'''
+
+    def __init__(self):
+        self.executed : set[int] = set()
+
+    def function_enter(self, name : str, args : tuple[Object, ...], position : Position) -> None:
+        self.executed.add(position[0])
+
+    def statement(self, position : Position) -> None:
+        self.executed.add(position[0])
+
+    def report(self, program : Tree, source : str) -> str:
+        '''create a coverage report of the `source` code, marking executed lines with `>` and missed ones with `!`'''
+        # function definitions and statements are executable
+        executable = {source_position(function_def)[0] for function_def in program.children}
+        executable |= {source_position(stmt)[0] for body in program.find_data('body') for stmt in body.children}
+        lines = []
+        for linenumber, line in enumerate(source.split('\n'), 1):
+            marker = ' ' if linenumber not in executable else '>' if linenumber in self.executed else '!'
+            lines.append(f'{marker} {linenumber:4d} | {line}')
+        covered = len(executable & self.executed)
+        lines.append(f'\ncovered {covered} of {len(executable)} lines ({covered / len(executable):.0%})')
+        return '\n'.join(lines)
+
+
+def printable(obj : Object):
+    '''convert an object into something JSON can represent'''
+    return obj.print()  # type: ignore[attr-defined]
+
+
+
+def main() -> None:
+    '''run the source code file specified as a command line argument with the selected hooks'''
+    # check command line args
+    if len(sys.argv) != 3 or sys.argv[1] not in ('trace', 'coverage'):
+        fail(f'USAGE: python {sys.argv[0]} (trace|coverage) FILE')
+    mode, filename = sys.argv[1:]
+
+    # open source code file
+    try:
+        with open(filename, encoding='utf-8') as input_file:
+            input_text = input_file.read()
+    except FileNotFoundError:
+        fail(f'File not found: {filename}')
+
+    # init error class
+    InterpreterError.init_class(input_text)
+
+    # run parser and interpreter with the hooks
+    hooks = TraceWriter(sys.stderr) if mode == 'trace' else Coverage()
+    try:
+        program = parse(input_text)
+        interpret(program, interpreter=Interpreter(hooks))
+    except (ParserError, InterpreterError) as error:
+        fail(error)
+    except KeyboardInterrupt:
+        fail('KeyboardInterrupt')
+
+    if isinstance(hooks, Coverage):
+        print(hooks.report(program, input_text), file=sys.stderr)
+
+
+
+if __name__ == '__main__':
+    main()